@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from scrape_pdb import pdb_parser, pdb_table, pdb_selection, atom_backchain
+from pdb_io import pdb_file_name
+from pdb_metrics import current_rss_mb
+from utilities import pdb_utilities, coordinate_index
+
+# offline benchmarks of the parse, coordinate index and dihedral hot paths.
+# runs on the entries bundled in ./pdb_data and on a synthetic entry written by generate_synthetic_pdb, and
+# reports throughput, latency and peak traced memory of every stage as json, e.g.
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --compare before.json
+
+bundled_chains = ['12ASA', '16VPA', '19HCA']
+
+# what a backbone only analysis (e.g. phi/psi) needs from the parser
+backbone_selection = pdb_selection(records=['ATOM'], atom_names=atom_backchain,
+                                   columns=['atom_name', 'alt_loc', 'res_name', 'res_seq', 'iCode', 'x', 'y', 'z'])
+
+amino_acids = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+               'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL']
+
+# ideal backbone geometry (bond lengths in angstroms, angles in degrees) used to grow the synthetic chains
+ideal_bonds = {'N-CA': 1.458, 'CA-C': 1.525, 'C-N': 1.329, 'C-O': 1.231, 'CA-CB': 1.530}
+ideal_angles = {'C-N-CA': 121.7, 'N-CA-C': 111.2, 'CA-C-N': 116.2, 'CA-C-O': 120.5, 'N-CA-CB': 110.5}
+
+def place_atom(a: np.ndarray, b: np.ndarray, c: np.ndarray, bond: float, angle: float, torsion: float):
+    # position of d with |cd| = bond, angle bcd and dihedral abcd (natural extension reference frame)
+    angle, torsion = np.radians(angle), np.radians(torsion)
+    bc = (c - b) / np.linalg.norm(c - b)
+    n = np.cross(b - a, bc)
+    n /= np.linalg.norm(n)
+    m = np.column_stack([bc, np.cross(n, bc), n])
+    d = bond * np.array([-np.cos(angle), np.sin(angle) * np.cos(torsion), np.sin(angle) * np.sin(torsion)])
+    return c + m @ d
+
+def synthetic_backbone(n_residues: int, phi: float=-57.0, psi: float=-47.0, omega: float=180.0):
+    # N, CA, C, O and CB coordinates of a chain with constant phi/psi (an alpha helix by default)
+    n = np.zeros((n_residues, 3))
+    ca = np.zeros((n_residues, 3))
+    c = np.zeros((n_residues, 3))
+    n[0] = [0, 0, 0]
+    ca[0] = [ideal_bonds['N-CA'], 0, 0]
+    theta = np.radians(ideal_angles['N-CA-C'])
+    c[0] = ca[0] + ideal_bonds['CA-C'] * np.array([-np.cos(theta), np.sin(theta), 0])
+    for i in range(1, n_residues):
+        n[i] = place_atom(n[i - 1], ca[i - 1], c[i - 1], ideal_bonds['C-N'], ideal_angles['CA-C-N'], psi)
+        ca[i] = place_atom(ca[i - 1], c[i - 1], n[i], ideal_bonds['N-CA'], ideal_angles['C-N-CA'], omega)
+        c[i] = place_atom(c[i - 1], n[i], ca[i], ideal_bonds['CA-C'], ideal_angles['N-CA-C'], phi)
+    o = np.array([place_atom(n[i], ca[i], c[i], ideal_bonds['C-O'], ideal_angles['CA-C-O'], psi + 180)
+                  for i in range(n_residues)])
+    cb = np.array([place_atom(c[i], n[i], ca[i], ideal_bonds['CA-CB'], ideal_angles['N-CA-CB'], -122.6)
+                   for i in range(n_residues)])
+    return {'N': n, 'CA': ca, 'C': c, 'O': o, 'CB': cb}
+
+def generate_synthetic_pdb(file_name: str, n_chains: int=4, n_residues: int=4000, seed: int=0):
+    # writes a pdb file of n_chains helical chains of n_residues each (N, CA, C, O and CB atoms, one HELIX
+    # record per chain). the legacy format caps an entry at 99,999 atoms and a chain at 9,999 residues
+    if n_chains * n_residues * 5 > 99999 or n_residues > 9999:
+        raise ValueError('{} chains of {} residues do not fit the pdb format'.format(n_chains, n_residues))
+    rng = np.random.default_rng(seed)
+    backbone = synthetic_backbone(n_residues)
+    res_name = np.array(amino_acids)[rng.integers(0, len(amino_acids), n_residues)]
+
+    l_lines = ['HEADER    SYNTHETIC BENCHMARK ENTRY']
+    for k in range(n_chains):
+        chain_id = chr(ord('A') + k)
+        l_lines.append('HELIX  {:>3d} {:>3d} {:3s} {:1s} {:>4d}  {:3s} {:1s} {:>4d}  1{:30s} {:>5d}'.format(
+            k + 1, k + 1, res_name[0], chain_id, 1, res_name[-1], chain_id, n_residues, '', n_residues))
+    serial = 1
+    for k in range(n_chains):
+        chain_id = chr(ord('A') + k)
+        # chains side by side, 40 angstroms apart
+        shift = np.array([40.0 * k, 0, 0])
+        for i in range(n_residues):
+            for atom_name in ['N', 'CA', 'C', 'O', 'CB']:
+                if atom_name == 'CB' and res_name[i] == 'GLY':
+                    continue
+                x, y, z = backbone[atom_name][i] + shift
+                l_lines.append('ATOM  {:>5d}  {:3s} {:3s} {:1s}{:>4d}    {:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}          {:>2s}  '.format(
+                    serial, atom_name, res_name[i], chain_id, i + 1, x, y, z, 1.0, 20.0, atom_name[0]))
+                serial += 1
+        l_lines.append('TER')
+    l_lines.append('END')
+    with open(file_name, 'w') as f:
+        f.write('\n'.join(l_lines) + '\n')
+    return file_name
+
+def count_lines(file_name: str):
+    with open(file_name, 'rb') as f:
+        return f.read().count(b'\n')
+
+def best_time(function, repeat: int):
+    # fastest of repeat runs and the result of the last one
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def peak_memory(function):
+    # peak traced allocations (python objects and numpy buffers) in MB while running function
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+def load_chains(l_pdb_name: list, pdb_dir: str):
+    # df_atom, df_helix and df_sheet of the given chains, parsed without the cull list or the cache
+    tables = {keyword: pdb_table(keyword) for keyword in ['ATOM', 'HELIX', 'SHEET']}
+    for pdb_name in l_pdb_name:
+        chain = pdb_parser.parse_chain(pdb_name, pdb_dir)
+        for keyword, table in tables.items():
+            table.append(chain[keyword], protein_name=pdb_name)
+    return [tables[keyword].to_frame() for keyword in ['ATOM', 'HELIX', 'SHEET']]
+
+def benchmark_parse(l_file_name: list, repeat: int, selection: pdb_selection=None):
+    n_lines = sum(count_lines(file_name) for file_name in l_file_name)
+    n_bytes = sum(os.path.getsize(file_name) for file_name in l_file_name)
+    seconds, entries = best_time(lambda: [pdb_parser.parse_entry(file_name, selection) for file_name in l_file_name], repeat)
+    n_atoms = sum(len(entry['ATOM']['chain_id']) for entry in entries)
+    return {'files': len(l_file_name), 'lines': n_lines, 'atoms': n_atoms, 'seconds': seconds,
+            'lines_per_s': n_lines / seconds, 'atoms_per_s': n_atoms / seconds, 'mb_per_s': n_bytes / 1024 / 1024 / seconds,
+            'peak_mb': peak_memory(lambda: [pdb_parser.parse_entry(file_name, selection) for file_name in l_file_name])}
+
+def benchmark_frames(l_pdb_name: list, pdb_dir: str, repeat: int):
+    # parse plus building the typed dataframes of the chains
+    seconds, frames = best_time(lambda: load_chains(l_pdb_name, pdb_dir), repeat)
+    return {'chains': len(l_pdb_name), 'atoms': len(frames[0]), 'seconds': seconds,
+            'atoms_per_s': len(frames[0]) / seconds,
+            'peak_mb': peak_memory(lambda: load_chains(l_pdb_name, pdb_dir))}, frames
+
+def benchmark_index(df_atom: pd.DataFrame, repeat: int, n_lookups: int=1000, seed: int=0):
+    build, index = best_time(lambda: coordinate_index(df_atom), repeat)
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(df_atom), n_lookups)
+    protein_name = df_atom['protein_name'].astype(str).to_numpy()[rows]
+    res_seq = df_atom['res_seq'].to_numpy()[rows]
+    atom_name = df_atom['atom_name'].astype(str).to_numpy()[rows]
+    icode = df_atom['iCode'].astype(str).to_numpy()[rows]
+
+    def scalar_lookups():
+        for i in range(n_lookups):
+            index.lookup(protein_name[i], res_seq[i], atom_name[i], icode[i])
+    scalar, _ = best_time(scalar_lookups, repeat)
+
+    # every atom of df_atom in one call
+    all_names = df_atom['protein_name'].astype(str).to_numpy()
+    all_res_seq = df_atom['res_seq'].to_numpy()
+    all_atom_names = df_atom['atom_name'].astype(str).to_numpy()
+    all_icode = df_atom['iCode'].astype(str).to_numpy()
+    batch, found = best_time(lambda: index.lookup(all_names, all_res_seq, all_atom_names, all_icode), repeat)
+
+    return {'atoms': len(df_atom), 'build_seconds': build, 'build_atoms_per_s': len(df_atom) / build,
+            'scalar_lookup_us': scalar / n_lookups * 1e6, 'batch_lookup_ns_per_atom': batch / len(df_atom) * 1e9,
+            'batch_found': int((found >= 0).sum()),
+            'peak_mb': peak_memory(lambda: coordinate_index(df_atom))}
+
+def benchmark_dihedrals(frames: list, repeat: int):
+    utilities = pdb_utilities(*frames)
+    seconds, df_angles = best_time(lambda: utilities.build_backbone_angles(), repeat)
+    return {'residues': len(df_angles), 'seconds': seconds, 'residues_per_s': len(df_angles) / seconds,
+            'median_phi': float(np.nanmedian(df_angles['phi'])), 'median_psi': float(np.nanmedian(df_angles['psi'])),
+            'peak_mb': peak_memory(lambda: utilities.build_backbone_angles())}
+
+def benchmark_dataset(l_pdb_name: list, pdb_dir: str, repeat: int):
+    l_file_name = [pdb_file_name(pdb_dir, protein_name) for protein_name in dict.fromkeys(n[:4] for n in l_pdb_name)]
+    results = {'parse': benchmark_parse(l_file_name, repeat),
+               'parse_backbone': benchmark_parse(l_file_name, repeat, backbone_selection)}
+    results['frames'], frames = benchmark_frames(l_pdb_name, pdb_dir, repeat)
+    results['index'] = benchmark_index(frames[0], repeat)
+    results['dihedrals'] = benchmark_dihedrals(frames, repeat)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(repeat: int=3, synthetic_chains: int=4, synthetic_residues: int=4000):
+    results = {'meta': {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                        'commit': git_commit(),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'pandas': pd.__version__,
+                        'machine': platform.machine(),
+                        'repeat': repeat}}
+
+    print('benchmarking bundled entries {}...'.format(bundled_chains))
+    results['bundled'] = benchmark_dataset(bundled_chains, './pdb_data', repeat)
+
+    if synthetic_chains and synthetic_residues:
+        print('benchmarking synthetic entry of {} x {} residues...'.format(synthetic_chains, synthetic_residues))
+        pdb_dir = tempfile.mkdtemp(prefix='pdb_benchmark_')
+        try:
+            generate_synthetic_pdb(pdb_dir + '/SYN1.pdb', synthetic_chains, synthetic_residues)
+            l_pdb_name = ['SYN1' + chr(ord('A') + k) for k in range(synthetic_chains)]
+            results['synthetic'] = benchmark_dataset(l_pdb_name, pdb_dir, repeat)
+        finally:
+            shutil.rmtree(pdb_dir)
+
+    max_rss_mb = current_rss_mb()
+    if max_rss_mb is not None:
+        results['meta']['max_rss_mb'] = max_rss_mb
+    return results
+
+def flatten(results: dict, prefix: str=''):
+    flat = dict()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+def compare(results: dict, baseline: dict):
+    # ratio of every metric to the baseline run, > 1 means a larger value now (faster for the *_per_s metrics)
+    current, previous = flatten(results), flatten(baseline)
+    for key in sorted(current):
+        if key in previous and previous[key] and not key.startswith('meta.'):
+            print('{:55s} {:>14.4g} {:>14.4g} {:>8.3f}x'.format(key, previous[key], current[key], current[key] / previous[key]))
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='benchmark the pdb parse, index and dihedral hot paths')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the fastest counts')
+    arg_parser.add_argument('--synthetic-chains', type=int, default=4)
+    arg_parser.add_argument('--synthetic-residues', type=int, default=4000, help='0 skips the synthetic entry')
+    arg_parser.add_argument('--output', help='json file to write the results to')
+    arg_parser.add_argument('--compare', help='json file of an earlier run to compare against')
+    args = arg_parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.synthetic_chains, args.synthetic_residues)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import os
+import tempfile
+
+# on-disk cache of parsed pdb entries used by pdb_parser.
+# every entry is stored as one uncompressed .npz file holding the column arrays of its ATOM, HELIX and SHEET
+# records (all chains). an entry is only loaded back if the size and mtime of the source file and the parser
+# version match the ones it was stored with, otherwise it counts as a miss and gets re-parsed.
+# once the cache grows past size_limit_mb the least recently used entries are evicted.
+class pdb_cache():
+    def __init__(self, cache_dir: str='./pdb_cache', parser_version: int=1, size_limit_mb: float=4096):
+        self.cache_dir = cache_dir
+        self.parser_version = parser_version
+        self.size_limit = int(size_limit_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.sizes = dict()
+        self.scan()
+
+    def scan(self):
+        # (re)reads the sizes of the cached entries, e.g. after other processes have written to the cache
+        self.sizes = {f: os.path.getsize(os.path.join(self.cache_dir, f))
+                      for f in os.listdir(self.cache_dir) if f.endswith('.npz') and not f.endswith('.tmp.npz')}
+
+    def cache_key(self, file_name: str):
+        st = os.stat(file_name)
+        return '{}:{}:{}'.format(st.st_size, st.st_mtime_ns, self.parser_version)
+
+    def cache_file(self, entry_name: str):
+        return os.path.join(self.cache_dir, '{}.npz'.format(entry_name))
+
+    def load(self, entry_name: str, file_name: str):
+        # returns {record name: {column: array}} or None on a miss
+        cache_file = self.cache_file(entry_name)
+        try:
+            with np.load(cache_file, allow_pickle=False) as data:
+                if str(data['__key__']) != self.cache_key(file_name):
+                    self.misses += 1
+                    return None
+                entry = dict()
+                for name in data.files:
+                    if name == '__key__' or name.endswith('.mask'):
+                        continue
+                    keyword, label = name.split('/')
+                    values = data[name]
+                    if values.dtype.kind == 'S':
+                        values = np.char.decode(values, 'ascii')
+                    elif name + '.mask' in data.files:
+                        values = pd.arrays.IntegerArray(values, data[name + '.mask'])
+                    entry.setdefault(keyword, dict())[label] = values
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        # bump mtime so eviction is least recently used rather than least recently written
+        os.utime(cache_file)
+        self.hits += 1
+        return entry
+
+    def store(self, entry_name: str, file_name: str, entry: dict):
+        arrays = {'__key__': np.array(self.cache_key(file_name))}
+        for keyword, columns in entry.items():
+            for label, values in columns.items():
+                name = '{}/{}'.format(keyword, label)
+                if isinstance(values, pd.arrays.IntegerArray):
+                    arrays[name] = values.to_numpy(dtype=np.int64, na_value=0)
+                    arrays[name + '.mask'] = values.isna()
+                elif values.dtype.kind == 'U':
+                    # pdb fields are ascii, stored as bytes they take a quarter of the space
+                    arrays[name] = np.char.encode(values, 'ascii')
+                else:
+                    arrays[name] = values
+
+        # write to a temp file first so a killed run never leaves a half written entry behind. the temp file
+        # has a unique name, processes sharing the cache (e.g. two notebook kernels) can store the same entry
+        # at the same time and the last replace wins
+        cache_file = self.cache_file(entry_name)
+        fd, tmp_file = tempfile.mkstemp(dir=self.cache_dir, prefix=entry_name + '.', suffix='.tmp.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            # mkstemp creates the file readable by the owner only
+            os.chmod(tmp_file, 0o644)
+            os.replace(tmp_file, cache_file)
+        except PermissionError:
+            # windows doesn't replace a file another process has open, that process just stored or loaded
+            # the entry so it is in the cache either way
+            os.remove(tmp_file)
+            return
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+        try:
+            self.sizes[os.path.basename(cache_file)] = os.path.getsize(cache_file)
+        except FileNotFoundError:
+            # already evicted by another process
+            return
+        if sum(self.sizes.values()) > self.size_limit:
+            self.evict()
+
+    def evict(self):
+        # drop least recently used entries until the cache is back under 90% of its limit
+        # other processes sharing the cache may have removed files already
+        def last_used(f):
+            try:
+                return os.path.getmtime(os.path.join(self.cache_dir, f))
+            except FileNotFoundError:
+                return 0
+
+        l_files = sorted(self.sizes, key=last_used)
+        total = sum(self.sizes.values())
+        for f in l_files:
+            if total <= 0.9 * self.size_limit:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, f))
+            except FileNotFoundError:
+                pass
+            total -= self.sizes.pop(f)
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.sizes), 'size_mb': round(sum(self.sizes.values()) / 1024 / 1024, 2)}
@@ -0,0 +1,98 @@
+import numpy as np
+import re
+from pdb_io import open_maybe_gzip
+
+# tokenizer for mmCIF files used by pdb_parser.parse_cif_entry.
+# only the categories that are asked for get tokenized, everything else is skipped line by line. a loop body is
+# tokenized in one go and reshaped into a (rows, items) array so every item comes out as a whole column.
+
+# a quoted value only ends at a quote followed by whitespace, so "O5'" and 'N,N' stay one token
+cif_token = re.compile(r"'(.*?)'(?=\s|$)|\"(.*?)\"(?=\s|$)|(\S+)")
+# '?' (unknown) and '.' (not applicable) are both read as blank
+cif_null = ('?', '.')
+
+def tokenize_cif(l_lines: list):
+    if not any(line.startswith(';') for line in l_lines):
+        text = ' '.join(l_lines)
+        if '"' not in text and "'" not in text:
+            # the common case (e.g. _atom_site of protein entries), no quoting at all
+            return text.split()
+        return [m.group(m.lastindex) for m in cif_token.finditer(text)]
+
+    # multi-line text fields between lines starting with ';'
+    tokens = list()
+    i = 0
+    while i < len(l_lines):
+        line = l_lines[i]
+        if line.startswith(';'):
+            l_text = [line[1:]]
+            i += 1
+            while i < len(l_lines) and not l_lines[i].startswith(';'):
+                l_text.append(l_lines[i])
+                i += 1
+            tokens.append('\n'.join(l_text).strip())
+        else:
+            tokens += [m.group(m.lastindex) for m in cif_token.finditer(line)]
+        i += 1
+    return tokens
+
+def skip_text_field(l_lines: list, i: int):
+    # index of the line after the text field starting at line i
+    i += 1
+    while i < len(l_lines) and not l_lines[i].startswith(';'):
+        i += 1
+    return i + 1
+
+def read_cif_categories(file_name: str, categories: list):
+    # {category: {item: str array}} of the given categories (e.g. '_atom_site') of an mmCIF file (plain or
+    # gzipped). categories written as key-value pairs instead of a loop come out as one row
+    with open_maybe_gzip(file_name) as f:
+        l_lines = f.read().decode('utf-8', errors='replace').splitlines()
+
+    categories = set(categories)
+    tables = dict()
+    i = 0
+    n_lines = len(l_lines)
+    while i < n_lines:
+        line = l_lines[i]
+        if line.startswith('loop_'):
+            i += 1
+            l_item = list()
+            while i < n_lines and l_lines[i].startswith('_'):
+                l_item.append(l_lines[i].split()[0])
+                i += 1
+            start = i
+            while i < n_lines and not l_lines[i].startswith(('_', 'loop_', '#', 'data_')):
+                i = skip_text_field(l_lines, i) if l_lines[i].startswith(';') else i + 1
+
+            category = l_item[0].split('.')[0] if l_item else None
+            if category in categories:
+                tokens = tokenize_cif(l_lines[start:i])
+                if len(tokens) % len(l_item):
+                    raise Exception('{} values of {} do not fill {} columns'.format(len(tokens), category, len(l_item)))
+                values = np.array(tokens, dtype=str).reshape(-1, len(l_item))
+                tables[category] = {item.split('.', 1)[1]: values[:, k] for k, item in enumerate(l_item)}
+
+        elif line.startswith('_'):
+            item = line.split(None, 1)[0]
+            category = item.split('.')[0]
+            start = i
+            i += 1
+            # the value is either on the same line or on the next (text field or a quoted string)
+            if len(line.split(None, 1)) == 1 and i < n_lines:
+                i = skip_text_field(l_lines, i) if l_lines[i].startswith(';') else i + 1
+            if category in categories:
+                tokens = tokenize_cif(l_lines[start:i])
+                tables.setdefault(category, dict())[item.split('.', 1)[1]] = np.array(tokens[1:2] or [''], dtype=str)
+
+        else:
+            i += 1
+
+    return tables
+
+def cif_column(table: dict, item: str, n_rows: int):
+    # column of a category with '?' and '.' blanked, all blank if the item is missing
+    if item not in table:
+        return np.full(n_rows, '', dtype=str)
+    values = table[item]
+    return np.where(np.isin(values, cif_null), '', values)
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+
+# layout of one atom in the corpus file. names and other short strings are stored as codes into the
+# vocabularies kept in the sidecar json, xyz is one (3,) field so chain coordinates come out as an (n, 3) view
+corpus_dtype = np.dtype([('xyz', '<f4', (3,)),
+                         ('serial_number', '<i4'),
+                         ('res_seq', '<i4'),
+                         ('occupancy', '<f4'),
+                         ('tempFactor', '<f4'),
+                         ('res_name', '<u2'),
+                         ('atom_name', '<u2'),
+                         ('element', 'u1'),
+                         ('alt_loc', 'u1'),
+                         ('iCode', 'u1'),
+                         ('charge', 'u1')])
+
+corpus_code_fields = ['res_name', 'atom_name', 'element', 'alt_loc', 'iCode', 'charge']
+
+# df_atom columns a corpus can't do without. the other fields are written with these defaults when a parser
+# with a column projection (pdb_parser(columns=...)) left them out
+corpus_required = ['protein_name', 'x', 'y', 'z', 'res_seq', 'res_name', 'atom_name']
+corpus_defaults = {'serial_number': 0, 'occupancy': np.nan, 'tempFactor': np.nan,
+                   'element': '', 'alt_loc': '', 'iCode': '', 'charge': ''}
+
+# writes atom records to a corpus: <path> holds the raw corpus_dtype records of all chains back to back and
+# <path>.json the vocabularies and the [start, stop) row offsets of every chain.
+# chains can be appended a few at a time (e.g. from pdb_parser.iter_chains), each chain has to arrive in one piece
+class corpus_writer():
+    def __init__(self, path: str):
+        self.path = path
+        self.f = open(path + '.tmp', 'wb')
+        self.vocabulary = {field: dict() for field in corpus_code_fields}
+        self.offsets = dict()
+        self.n_rows = 0
+
+    def encode(self, field: str, values):
+        vocabulary = self.vocabulary[field]
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        codes = np.array([vocabulary.setdefault(u, len(vocabulary)) for u in uniques], dtype=np.int64)
+        if len(vocabulary) > np.iinfo(corpus_dtype[field]).max + 1:
+            raise Exception('too many distinct values of {} for the corpus'.format(field))
+        return codes[inverse.ravel()]
+
+    def append(self, df_atom: pd.DataFrame):
+        missing = [label for label in corpus_required if label not in df_atom]
+        if missing:
+            raise Exception('a corpus needs the {} columns of the atom records'.format(', '.join(missing)))
+        if len(df_atom) == 0:
+            return
+        protein_name = df_atom['protein_name'].astype(str).to_numpy()
+        order = np.argsort(pd.factorize(protein_name)[0], kind='stable')
+        df_atom = df_atom.iloc[order]
+        protein_name = protein_name[order]
+
+        records = np.zeros(len(df_atom), dtype=corpus_dtype)
+        records['xyz'] = df_atom[['x', 'y', 'z']].to_numpy(dtype=np.float32)
+        for field in ['serial_number', 'res_seq', 'occupancy', 'tempFactor']:
+            records[field] = df_atom[field].to_numpy() if field in df_atom else corpus_defaults[field]
+        for field in corpus_code_fields:
+            values = df_atom[field] if field in df_atom else np.full(len(df_atom), corpus_defaults[field])
+            records[field] = self.encode(field, values)
+
+        starts = np.flatnonzero(np.r_[True, protein_name[1:] != protein_name[:-1]])
+        stops = np.r_[starts[1:], len(protein_name)]
+        for start, stop in zip(starts, stops):
+            if protein_name[start] in self.offsets:
+                raise Exception('{} was already written to the corpus'.format(protein_name[start]))
+            self.offsets[protein_name[start]] = [int(self.n_rows + start), int(self.n_rows + stop)]
+
+        self.f.write(records.tobytes())
+        self.n_rows += len(records)
+
+    def copy_chains(self, corpus, chains: list):
+        # appends chains of another corpus record for record, only the vocabulary codes are remapped
+        codes = {field: np.array([self.vocabulary[field].setdefault(value, len(self.vocabulary[field]))
+                                  for value in corpus.vocabulary[field]], dtype=np.int64)
+                 for field in corpus_code_fields}
+        for field in corpus_code_fields:
+            if len(self.vocabulary[field]) > np.iinfo(corpus_dtype[field]).max + 1:
+                raise Exception('too many distinct values of {} for the corpus'.format(field))
+        for name in chains:
+            if name in self.offsets:
+                raise Exception('{} was already written to the corpus'.format(name))
+            records = np.array(corpus.chain(name))
+            for field in corpus_code_fields:
+                if len(codes[field]):
+                    records[field] = codes[field][records[field]]
+            self.offsets[name] = [self.n_rows, self.n_rows + len(records)]
+            self.f.write(records.tobytes())
+            self.n_rows += len(records)
+
+    def close(self):
+        self.f.close()
+        meta = {'n_rows': self.n_rows,
+                'dtype': corpus_dtype.descr,
+                'vocabulary': {field: list(vocabulary) for field, vocabulary in self.vocabulary.items()},
+                'offsets': self.offsets}
+        with open(self.path + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.path + '.tmp', self.path)
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+
+# read only view of a corpus written by corpus_writer. the records are memory mapped, so every process that
+# opens the same corpus shares one copy of it through the page cache, and chain() returns zero-copy views.
+# pdb_utilities takes a pdb_corpus in place of df_atom
+class pdb_corpus():
+    def __init__(self, path: str):
+        self.path = path
+        with open(path + '.json', 'r') as f:
+            meta = json.load(f)
+        self.vocabulary = {field: np.array(values, dtype=str) for field, values in meta['vocabulary'].items()}
+        self.offsets = {name: tuple(offset) for name, offset in meta['offsets'].items()}
+        self.chains = list(self.offsets)
+        if meta['n_rows']:
+            self.records = np.memmap(path, dtype=corpus_dtype, mode='r', shape=(meta['n_rows'],))
+        else:
+            self.records = np.zeros(0, dtype=corpus_dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def chain(self, protein_name: str):
+        # structured records of one chain (a view into the memory map)
+        start, stop = self.offsets[protein_name]
+        return self.records[start:stop]
+
+    def coordinates(self, protein_name: str):
+        # (n, 3) float32 coordinates of one chain (a view into the memory map)
+        return self.chain(protein_name)['xyz']
+
+    def decode(self, field: str, codes: np.ndarray):
+        return pd.Categorical.from_codes(codes.astype(np.int64), categories=self.vocabulary[field])
+
+    def to_frame(self, chains: list=None):
+        # df_atom of the given chains (all by default) with the same columns and dtypes pdb_parser produces
+        chains = self.chains if chains is None else list(chains)
+        if chains == self.chains:
+            records = self.records
+        else:
+            records = np.concatenate([self.chain(name) for name in chains]) if chains else self.records[:0]
+        lengths = [self.offsets[name][1] - self.offsets[name][0] for name in chains]
+        protein_name = pd.Categorical.from_codes(np.repeat(np.arange(len(chains)), lengths), categories=chains)
+        chain_id = pd.Categorical(pd.Series(protein_name).astype(str).str[4:].to_numpy())
+
+        return pd.DataFrame({'record_name': pd.Categorical(np.full(len(records), 'ATOM')),
+                             'serial_number': np.asarray(records['serial_number']),
+                             'atom_name': self.decode('atom_name', records['atom_name']),
+                             'alt_loc': self.decode('alt_loc', records['alt_loc']),
+                             'res_name': self.decode('res_name', records['res_name']),
+                             'chain_id': chain_id,
+                             'res_seq': np.asarray(records['res_seq']),
+                             'iCode': self.decode('iCode', records['iCode']),
+                             'x': np.asarray(records['xyz'][:, 0]),
+                             'y': np.asarray(records['xyz'][:, 1]),
+                             'z': np.asarray(records['xyz'][:, 2]),
+                             'occupancy': np.asarray(records['occupancy']),
+                             'tempFactor': np.asarray(records['tempFactor']),
+                             'element': self.decode('element', records['element']),
+                             'charge': self.decode('charge', records['charge']),
+                             'protein_name': protein_name})
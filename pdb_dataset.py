@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+
+# partitioned columnar storage of df_atom/df_helix/df_sheet, numpy only (no parquet library in the environment).
+# a table is stored as <path>/<table>/meta.json plus one directory per partition holding one .npy file per
+# column. categoricals are stored as int32 codes into the categories kept in meta.json, nullable integers as
+# values plus a <column>.mask.npy and everything else with its own dtype (strings as fixed width unicode), so
+# tables load back with the dtypes they were written with.
+# partitions hold whole chains: one per pdb entry with partition_by='entry' or chains_per_partition chains with
+# partition_by='chunk'. meta.json lists the chains of every partition, so reads filtered by protein_name skip
+# the other partitions without opening them, and only the filtered and projected columns are read at all.
+
+def partition_bounds(protein_name: pd.Series, partition_by: str='chunk', chains_per_partition: int=500):
+    # [start, stop) rows of every partition, the rows of a chain have to be contiguous (as pdb_parser writes them)
+    names = protein_name.astype(str).to_numpy()
+    if not len(names):
+        return []
+    run_starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+    if partition_by == 'entry':
+        entry = np.char.ljust(names[run_starts].astype(str), 4).astype('U4')
+        starts = run_starts[np.r_[True, entry[1:] != entry[:-1]]]
+    elif partition_by == 'chunk':
+        starts = run_starts[::chains_per_partition]
+    else:
+        raise ValueError('partition_by has to be entry or chunk, not {}'.format(partition_by))
+    stops = np.r_[starts[1:], len(names)]
+    return list(zip(starts.tolist(), stops.tolist()))
+
+def column_kind(values: pd.Series):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return 'category'
+    if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) and values.dtype.kind in 'iu':
+        return 'nullable'
+    if values.dtype.kind in 'iufb':
+        return 'numeric'
+    return 'str'
+
+def write_table(path: str, table: str, df: pd.DataFrame, partition_by: str='chunk', chains_per_partition: int=500):
+    table_dir = os.path.join(path, table)
+    tmp_dir = table_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    columns = dict()
+    for label in df.columns:
+        kind = column_kind(df[label])
+        columns[label] = {'kind': kind, 'dtype': str(df[label].dtype)}
+        if kind == 'category':
+            columns[label]['categories'] = [str(c) for c in df[label].cat.categories]
+
+    partitions = list()
+    for k, (start, stop) in enumerate(partition_bounds(df['protein_name'], partition_by, chains_per_partition)):
+        name = 'part-{:05d}'.format(k)
+        os.makedirs(os.path.join(tmp_dir, name))
+        df_part = df.iloc[start:stop]
+        for label, column in columns.items():
+            file_name = os.path.join(tmp_dir, name, label)
+            values = df_part[label]
+            if column['kind'] == 'category':
+                np.save(file_name + '.npy', values.cat.codes.to_numpy().astype(np.int32))
+            elif column['kind'] == 'nullable':
+                np.save(file_name + '.npy', values.to_numpy(dtype=np.int64, na_value=0))
+                np.save(file_name + '.mask.npy', values.isna().to_numpy())
+            elif column['kind'] == 'str':
+                np.save(file_name + '.npy', np.asarray(values.to_numpy(), dtype=str))
+            else:
+                np.save(file_name + '.npy', values.to_numpy())
+        partitions.append({'name': name, 'n_rows': stop - start,
+                           'chains': list(dict.fromkeys(df_part['protein_name'].astype(str)))})
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'columns': columns, 'partitions': partitions, 'partition_by': partition_by}, f)
+    if os.path.exists(table_dir):
+        shutil.rmtree(table_dir)
+    os.replace(tmp_dir, table_dir)
+
+def filter_mask(values: np.ndarray, condition, categories: list=None):
+    # condition is a value, a list/set of values or a (low, high) tuple for an inclusive range.
+    # categorical columns are compared on their codes
+    if isinstance(condition, tuple):
+        low, high = condition
+        return (values >= low) & (values <= high)
+    l_value = list(condition) if isinstance(condition, (list, set, np.ndarray, pd.Index)) else [condition]
+    if categories is not None:
+        index = pd.Index(categories)
+        l_value = index.get_indexer([str(v) for v in l_value])
+        l_value = l_value[l_value >= 0]
+    return np.isin(values, l_value)
+
+def read_column(part_dir: str, label: str, column: dict, rows: np.ndarray=None):
+    values = np.load(os.path.join(part_dir, label + '.npy'), mmap_mode='r')
+    values = np.asarray(values if rows is None else values[rows])
+    if column['kind'] == 'category':
+        return pd.Categorical.from_codes(values.astype(np.int64), categories=column['categories'])
+    if column['kind'] == 'nullable':
+        mask = np.load(os.path.join(part_dir, label + '.mask.npy'), mmap_mode='r')
+        mask = np.asarray(mask if rows is None else mask[rows])
+        return pd.array(pd.arrays.IntegerArray(values, mask), dtype=column['dtype'])
+    return values
+
+def read_table(path: str, table: str, columns: list=None, filters: dict=None):
+    # df of one table with only the given columns (all by default) and the rows passing every filter.
+    # filters map columns to a value, a list of values or a (low, high) range, e.g.
+    # {'protein_name': ['12ASA'], 'res_name': ['GLY', 'PRO'], 'res_seq': (1, 100), 'record_name': 'ATOM'}
+    table_dir = os.path.join(path, table)
+    with open(os.path.join(table_dir, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    meta_columns = meta['columns']
+    columns = list(meta_columns) if columns is None else list(columns)
+    filters = dict() if filters is None else filters
+    for label in list(columns) + list(filters):
+        if label not in meta_columns:
+            raise KeyError('{} is not a column of {}'.format(label, table))
+
+    partitions = meta['partitions']
+    if 'protein_name' in filters and not isinstance(filters['protein_name'], tuple):
+        condition = filters['protein_name']
+        wanted = set(condition) if isinstance(condition, (list, set, np.ndarray, pd.Index)) else {condition}
+        partitions = [partition for partition in partitions if wanted.intersection(partition['chains'])]
+
+    l_part = list()
+    for partition in partitions:
+        part_dir = os.path.join(table_dir, partition['name'])
+        rows = None
+        for label, condition in filters.items():
+            column = meta_columns[label]
+            values = np.load(os.path.join(part_dir, label + '.npy'), mmap_mode='r')
+            mask = filter_mask(np.asarray(values), condition, column.get('categories'))
+            rows = mask if rows is None else rows & mask
+        if rows is not None:
+            rows = np.flatnonzero(rows)
+            if not len(rows):
+                continue
+        l_part.append({label: read_column(part_dir, label, meta_columns[label], rows) for label in columns})
+
+    data = dict()
+    for label in columns:
+        column = meta_columns[label]
+        l_values = [part[label] for part in l_part]
+        if column['kind'] == 'category':
+            codes = np.concatenate([values.codes for values in l_values]) if l_values else np.zeros(0, dtype=np.int8)
+            data[label] = pd.Categorical.from_codes(codes, categories=column['categories'])
+        elif column['kind'] == 'nullable':
+            data[label] = pd.concat([pd.Series(values) for values in l_values], ignore_index=True) \
+                if l_values else pd.array([], dtype=column['dtype'])
+        else:
+            data[label] = np.concatenate(l_values) if l_values else np.array([], dtype=column['dtype']
+                                                                              if column['kind'] == 'numeric' else str)
+    return pd.DataFrame(data, columns=columns)
@@ -0,0 +1,161 @@
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from pdb_io import pdb_file_name
+from pdb_metrics import metrics
+import tempfile
+import gzip
+import threading
+import time
+import os
+
+# downloads pdb entries into pdb_dir.
+# all requests go through one session so connections to the server are reused, and up to n_connections
+# entries are fetched at the same time. failed requests are retried with exponential backoff.
+# a download is first written to a temp file in pdb_dir and only renamed to <id>.pdb once it has been
+# validated, so an interrupted run or an error page never ends up looking like a finished entry.
+# base_url can point at a local mirror, e.g. 'http://localhost:8000'
+# with compress=True (the default) entries are stored as <id>.pdb.gz, which pdb_parser reads directly.
+# entries that don't exist in the legacy pdb format (too many atoms, long chain ids) are fetched as mmCIF
+class pdb_downloader():
+    def __init__(self, pdb_dir: str='./pdb_data', base_url: str='https://files.rcsb.org/view',
+                 n_connections: int=16, retries: int=4, backoff: float=0.5, timeout: float=30,
+                 compress: bool=True):
+        self.pdb_dir = pdb_dir
+        self.compress = compress
+        self.base_url = base_url.rstrip('/')
+        self.n_connections = n_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=n_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.n_downloaded = 0
+        self.n_skipped = 0
+        self.failed = dict()
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.pdb_dir):
+            os.makedirs(self.pdb_dir)
+
+    def url(self, protein_name: str, fmt: str='pdb'):
+        return '{}/{}.{}'.format(self.base_url, protein_name, fmt)
+
+    def file_name(self, protein_name: str, fmt: str='pdb'):
+        # where a new download of protein_name is stored
+        return self.pdb_dir + '/{}.{}{}'.format(protein_name, fmt, '.gz' if self.compress else '')
+
+    @staticmethod
+    def validate(content: bytes, fmt: str='pdb'):
+        if fmt == 'cif':
+            # mmCIF entries have an _atom_site loop and end with a '#' line
+            return content.startswith(b'data_') and b'\n_atom_site.' in content and content.rstrip().endswith(b'#')
+        # a complete pdb entry has coordinates and ends with the END record
+        return (content.startswith(b'ATOM  ') or b'\nATOM  ' in content) and \
+               content.rstrip().endswith(b'\nEND')
+
+    @staticmethod
+    def is_complete(file_name: str):
+        # cheap check for files already on disk, only looks at the tail of the file for the END record.
+        # gzipped entries are only ever written by write_atomic after validation so existing means complete
+        if file_name.endswith('.gz'):
+            return os.path.exists(file_name)
+        try:
+            with open(file_name, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(f.tell() - 256, 0))
+                tail = f.read().rstrip()
+                return tail.endswith(b'#') if file_name.endswith('.cif') else tail.endswith(b'\nEND')
+        except OSError:
+            return False
+
+    def download(self, protein_name: str):
+        # returns True if the entry is on disk afterwards
+        file_name = pdb_file_name(self.pdb_dir, protein_name)
+        while os.path.exists(file_name) and not self.is_complete(file_name):
+            # a truncated file or error page from an older run would shadow the entry in any other format
+            os.remove(file_name)
+            metrics.add('download.invalid')
+            file_name = pdb_file_name(self.pdb_dir, protein_name)
+        if self.is_complete(file_name):
+            with self.lock:
+                self.n_skipped += 1
+                # an entry that failed before can be on disk now, parse paths skip everything in failed
+                self.failed.pop(protein_name, None)
+            return True
+
+        errors = list()
+        for fmt in ['pdb', 'cif']:
+            error = self.fetch(protein_name, fmt)
+            if error is None:
+                with self.lock:
+                    self.n_downloaded += 1
+                    self.failed.pop(protein_name, None)
+                return True
+            errors.append('{}: {}'.format(fmt, error))
+            if error != 'not found':
+                # only fall back to mmCIF if the entry doesn't exist as a pdb file
+                break
+
+        with self.lock:
+            self.failed[protein_name] = ', '.join(errors)
+        metrics.add('download.failures')
+        return False
+
+    def fetch(self, protein_name: str, fmt: str):
+        # downloads one format of an entry, returns None on success or the last error
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.add('download.retries')
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with metrics.timer('download.request'):
+                    r = self.session.get(self.url(protein_name, fmt), timeout=self.timeout)
+                if r.status_code == 404:
+                    # not available in this format, no point in retrying
+                    return 'not found'
+                r.raise_for_status()
+                if not self.validate(r.content, fmt):
+                    raise ValueError('incomplete or invalid {} file'.format(fmt))
+                content = gzip.compress(r.content, compresslevel=6) if self.compress else r.content
+                self.write_atomic(self.file_name(protein_name, fmt), content)
+                metrics.add('download.files')
+                metrics.add('download.bytes', len(r.content))
+                return None
+            except (requests.RequestException, ValueError) as e:
+                error = str(e)
+        return error
+
+    def write_atomic(self, file_name: str, content: bytes):
+        fd, tmp_file = tempfile.mkstemp(dir=self.pdb_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            # mkstemp creates the file readable by the owner only
+            os.chmod(tmp_file, 0o644)
+            os.replace(tmp_file, file_name)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+    def download_all(self, l_protein_name: list):
+        # l_protein_name are entry ids (12AS), every entry is fetched once however often it is listed.
+        # returns whether each of l_protein_name is on disk, in the same order
+        l_unique = list(dict.fromkeys(l_protein_name))
+        # failures of earlier calls (e.g. earlier chunks of the same run) were already reported
+        previously_failed = set(self.failed)
+        with metrics.timer('download'), ThreadPoolExecutor(max_workers=self.n_connections) as executor:
+            done = dict(zip(l_unique, executor.map(self.download, l_unique)))
+        results = [done[protein_name] for protein_name in l_protein_name]
+
+        failed = sorted(set(self.failed) - previously_failed)
+        if failed:
+            print('failed to download {} pdbs: {}'.format(len(failed), failed[:10]))
+        return results
+
+    def stats(self):
+        return {'downloaded': self.n_downloaded, 'skipped': self.n_skipped, 'failed': len(self.failed)}
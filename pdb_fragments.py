@@ -0,0 +1,249 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+
+# search index over backbone fragments: every window of `window` consecutive residues of a chain is described by
+# its phi/psi (and optionally omega) angles. angles are embedded as (cos, sin) pairs, so the euclidean distance
+# of two embeddings is the chord distance sqrt(sum(2 - 2 cos(a - b))) over all angles of the window, which is
+# periodic (179 and -179 degrees are 2 degrees apart) and grows with the angle differences up to 180 degrees.
+# a window whose every angle differs by d degrees from the query is at distance angle_radius(d, n_angles).
+# windows are grouped into inverted lists around k-means centroids and stored sorted by list and by distance to
+# the list's centroid. by the triangle inequality no window of a list is closer to a query than
+# |query - centroid| - list radius, and only windows whose distance to the centroid is within r of the query's
+# can be within r of the query, so a query reads a slice of the lists that can hold an answer. knn and radius
+# queries are exact while touching a small part of the data.
+# the index is saved as a directory of .npy files plus meta.json and loaded memory mapped
+
+def angle_radius(degrees: float, n_angles: int):
+    # embedding distance of a window whose n_angles angles each differ by degrees from the query
+    return np.sqrt(n_angles) * 2 * np.sin(np.radians(degrees) / 2)
+
+def embed_angles(angles: np.ndarray):
+    # (n, window, n_angles) angles in degrees to (n, 2 * window * n_angles) float32 embeddings
+    angles = np.radians(np.asarray(angles, dtype=np.float64))
+    angles = angles.reshape(len(angles), int(np.prod(angles.shape[1:])))
+    return np.concatenate([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+
+def nearest_centroid(x: np.ndarray, centroids: np.ndarray, block_size: int=8192):
+    # (label, distance) of the closest centroid of every row of x, block_size rows at a time. the distance is
+    # recomputed from the difference, the expanded form used to find the closest one loses precision
+    labels = np.zeros(len(x), dtype=np.int64)
+    distances = np.zeros(len(x), dtype=np.float32)
+    # |x - c|^2 - |x|^2, the |x|^2 of a row doesn't change which centroid is closest
+    norm_c = np.sum(centroids ** 2, axis=1)
+    minus_2c = (-2 * centroids).T.copy()
+    for start in range(0, len(x), block_size):
+        block = np.asarray(x[start:start + block_size], dtype=np.float32)
+        d2 = block @ minus_2c
+        d2 += norm_c
+        labels[start:start + block_size] = np.argmin(d2, axis=1)
+        diff = block - centroids[labels[start:start + block_size]]
+        distances[start:start + block_size] = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    return labels, distances
+
+def kmeans(x: np.ndarray, n_clusters: int, n_iterations: int=20, sample_size: int=1 << 16, seed: int=0):
+    # centroids of n_clusters clusters of a random sample of x (lloyd iterations, empty clusters keep their centroid)
+    rng = np.random.default_rng(seed)
+    sample = x[np.sort(rng.choice(len(x), min(sample_size, len(x)), replace=False))].astype(np.float32)
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(n_iterations):
+        labels, _ = nearest_centroid(sample, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.stack([np.bincount(labels, weights=sample[:, d], minlength=n_clusters)
+                         for d in range(sample.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+    return centroids
+
+class fragment_index():
+    def __init__(self, meta: dict, arrays: dict):
+        self.window = meta['window']
+        self.angles = meta['angles']
+        self.chain_names = np.array(meta['chain_names'], dtype=str)
+        # per list: centroid, largest distance of a member to it and [offsets[l], offsets[l+1]) rows
+        self.centroids = np.asarray(arrays['centroids'])
+        self.radii = np.asarray(arrays['radii'])
+        self.offsets = np.asarray(arrays['offsets'])
+        # per window, sorted by list and distance to the centroid: embedding, that distance and first residue
+        self.embeddings = arrays['embeddings']
+        self.centroid_distances = arrays['centroid_distances']
+        self.starts = arrays['starts']
+        # list * span + distance to the centroid is sorted, so the windows of any lists at a given distance range
+        # from their centroids are found with one searchsorted (no distance is larger than 2 sqrt(dimensions))
+        self.span = 2 * np.sqrt(self.centroids.shape[1]) + 1
+        self.keys = np.repeat(np.arange(len(self.radii)), np.diff(self.offsets)) * self.span + \
+            np.asarray(self.centroid_distances, dtype=np.float64)
+        # per residue of the angle table the index was built from
+        self.chain = arrays['chain']
+        self.res_seq = arrays['res_seq']
+        self.icode = arrays['icode']
+        self.res_name = arrays['res_name']
+
+    def __len__(self):
+        return len(self.starts)
+
+    @staticmethod
+    def window_starts(df_angles: pd.DataFrame, window: int, angles: tuple):
+        # first residue of every window of the angle table (as from pdb_utilities.build_backbone_angles) lying in
+        # one chain with all angles known. angles across chain breaks are nan, so windows don't span breaks
+        values = df_angles[list(angles)].to_numpy(dtype=np.float64)
+        chain = pd.factorize(df_angles['protein_name'])[0]
+        bad = ~np.isfinite(values).all(axis=1)
+        bad[1:] |= chain[1:] != chain[:-1]
+        # a window starting at i is good if residues i+1..i+window-1 don't start a new chain and none is nan
+        n_bad = np.r_[0, np.cumsum(bad)]
+        starts = np.arange(max(len(values) - window + 1, 0))
+        good = (n_bad[starts + window] - n_bad[starts + 1] == 0) & np.isfinite(values[starts]).all(axis=1)
+        return starts[good], values
+
+    @staticmethod
+    def build(df_angles: pd.DataFrame, window: int=7, angles: tuple=('phi', 'psi'), n_lists: int=None,
+              seed: int=0):
+        # index over every window of df_angles. n_lists defaults to about 2 sqrt(number of windows)
+        angles = list(angles)
+        starts, values = fragment_index.window_starts(df_angles, window, angles)
+        embeddings = embed_angles(values[starts[:, None] + np.arange(window)])
+        if n_lists is None:
+            n_lists = int(2 * np.sqrt(len(starts)))
+        n_lists = int(np.clip(n_lists, 1, max(len(starts), 1)))
+
+        if len(starts):
+            centroids = kmeans(embeddings, n_lists, seed=seed)
+            labels, distances = nearest_centroid(embeddings, centroids)
+        else:
+            centroids = np.zeros((n_lists, embeddings.shape[1]), dtype=np.float32)
+            labels, distances = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        # sorted by list and within a list by distance to its centroid
+        order = np.lexsort((distances, labels))
+        counts = np.bincount(labels, minlength=n_lists)
+        radii = np.zeros(n_lists, dtype=np.float32)
+        np.maximum.at(radii, labels, distances)
+
+        chain, chain_names = pd.factorize(df_angles['protein_name'].astype(str))
+        meta = {'window': window, 'angles': angles, 'chain_names': [str(name) for name in chain_names]}
+        arrays = {'centroids': centroids,
+                  'radii': radii,
+                  'offsets': np.r_[0, np.cumsum(counts)].astype(np.int64),
+                  'embeddings': embeddings[order],
+                  'centroid_distances': distances[order],
+                  'starts': starts[order].astype(np.int64),
+                  'chain': chain.astype(np.int32),
+                  'res_seq': df_angles['res_seq'].to_numpy().astype(np.int32),
+                  'icode': np.asarray(df_angles['iCode'].astype(str).to_numpy(), dtype=str),
+                  'res_name': np.asarray(df_angles['res_name'].astype(str).to_numpy(), dtype=str)}
+        return fragment_index(meta, arrays)
+
+    def save(self, path: str):
+        tmp_dir = path + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in ['centroids', 'radii', 'offsets', 'embeddings', 'centroid_distances', 'starts', 'chain', 'res_seq',
+                     'icode', 'res_name']:
+            np.save(os.path.join(tmp_dir, name + '.npy'), np.asarray(getattr(self, name)))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'window': self.window, 'angles': self.angles, 'chain_names': self.chain_names.tolist()}, f)
+        if os.path.exists(path):
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+        os.replace(tmp_dir, path)
+
+    @staticmethod
+    def load(path: str, mmap: bool=True):
+        # with mmap the windows stay on disk and a query only reads the lists it scans
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r' if mmap else None)
+                  for name in os.listdir(path) if name.endswith('.npy')}
+        return fragment_index(meta, arrays)
+
+    def embed_query(self, query):
+        # query angles in degrees, (window, n_angles) for one query or (m, window, n_angles)
+        query = np.asarray(query, dtype=np.float64)
+        if query.ndim == 2:
+            query = query[None]
+        if query.shape[1:] != (self.window, len(self.angles)):
+            raise ValueError('queries have to be {} residues of {}, not {}'.format(self.window, self.angles, query.shape[1:]))
+        return embed_angles(query)
+
+    def centroid_distances_to(self, embedded: np.ndarray):
+        # (m, n_lists) distances of the embedded queries to all centroids
+        return np.stack([np.linalg.norm(self.centroids.astype(np.float64) - q, axis=1) for q in embedded]) \
+            if len(embedded) else np.zeros((0, len(self.centroids)))
+
+    def scan(self, lists: np.ndarray, q: np.ndarray, to_centroid: np.ndarray, radius: float):
+        # (rows, distances) of the windows of the given lists that can be within radius of q: by the triangle
+        # inequality only those whose distance to their centroid is within radius of the query's (plus a little
+        # slack for float32 rounding)
+        # the key range is clipped to the keys of the list itself, [list * span, list * span + radius of the list],
+        # so a large radius doesn't run into the neighbouring lists and return their windows twice
+        first = lists * self.span
+        lower = np.maximum(first + to_centroid[lists] - radius - 1e-4, first)
+        upper = np.minimum(first + to_centroid[lists] + radius + 1e-4, first + self.radii[lists].astype(np.float64))
+        start = np.searchsorted(self.keys, lower, side='left')
+        stop = np.searchsorted(self.keys, upper, side='right')
+        counts = np.maximum(stop - start, 0)
+        if not counts.sum():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = np.repeat(start, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        diff = np.asarray(self.embeddings[rows]) - q
+        return rows, np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    def query_knn(self, query, k: int=10):
+        # (rows, distances) of the k windows closest to every query, both (m, k) and sorted by distance,
+        # padded with -1 and inf if the index holds fewer than k windows. rows go into fragments()
+        embedded = self.embed_query(query)
+        rows = np.full((len(embedded), k), -1, dtype=np.int64)
+        distances = np.full((len(embedded), k), np.inf, dtype=np.float32)
+        for m, (q, to_centroid) in enumerate(zip(embedded, self.centroid_distances_to(embedded))):
+            # no window of a list is closer than its bound
+            bounds = np.maximum(to_centroid - self.radii - 1e-4, 0)
+            order = np.argsort(bounds)
+            best_rows, best_distances = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            p, step = 0, 1
+            # lists are scanned closest bound first, in growing batches, until no list left can beat the kth best
+            while p < len(order):
+                radius = best_distances.max() if len(best_rows) >= k else np.inf
+                if radius <= bounds[order[p]]:
+                    break
+                batch = order[p:p + step]
+                p, step = p + step, step * 2
+                batch_rows, batch_distances = self.scan(batch, q, to_centroid, radius)
+                best_rows = np.concatenate([best_rows, batch_rows])
+                best_distances = np.concatenate([best_distances, batch_distances])
+                if len(best_rows) > k:
+                    keep = np.argpartition(best_distances, k - 1)[:k]
+                    best_rows, best_distances = best_rows[keep], best_distances[keep]
+            order = np.lexsort((best_rows, best_distances))
+            rows[m, :len(order)] = best_rows[order]
+            distances[m, :len(order)] = best_distances[order]
+        return rows, distances
+
+    def query_radius(self, query, radius: float):
+        # all (query, row, distance) with a window within radius (embedding distance, see angle_radius) of the
+        # query, sorted by query and then distance
+        embedded = self.embed_query(query)
+        l_query, l_row, l_distance = list(), list(), list()
+        for m, (q, to_centroid) in enumerate(zip(embedded, self.centroid_distances_to(embedded))):
+            lists = np.flatnonzero(to_centroid - self.radii - 1e-4 <= radius)
+            rows, distances = self.scan(lists, q, to_centroid, radius)
+            close = distances <= radius
+            order = np.lexsort((rows[close], distances[close]))
+            l_query.append(np.full(len(order), m, dtype=np.int64))
+            l_row.append(rows[close][order])
+            l_distance.append(distances[close][order])
+        if not l_query:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(l_query), np.concatenate(l_row), np.concatenate(l_distance)
+
+    def fragments(self, rows: np.ndarray):
+        # chain, first residue and residue names of the windows at rows (as returned by the queries)
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        start = np.asarray(self.starts[rows])
+        residues = start[:, None] + np.arange(self.window)
+        res_name = np.asarray(self.res_name)[residues]
+        return pd.DataFrame({'row': rows,
+                             'protein_name': self.chain_names[np.asarray(self.chain)[start]],
+                             'res_seq': np.asarray(self.res_seq)[start],
+                             'iCode': np.asarray(self.icode)[start],
+                             'sequence': ['-'.join(names) for names in res_name]})
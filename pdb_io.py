@@ -0,0 +1,31 @@
+import gzip
+import io
+import os
+
+gzip_magic = b'\x1f\x8b'
+# read size for pdb files and cull lists, large reads keep the number of system calls down on big entries
+buffer_size = 1 << 20
+
+def is_gzip(file_name: str):
+    # compression is detected from the magic bytes, not the file extension (the cull list is called .gz
+    # but is plain text)
+    with open(file_name, 'rb') as f:
+        return f.read(2) == gzip_magic
+
+def open_maybe_gzip(file_name: str):
+    # binary file handle that transparently decompresses gzipped files while reading
+    if is_gzip(file_name):
+        return io.BufferedReader(gzip.GzipFile(file_name, 'rb'), buffer_size=buffer_size)
+    return open(file_name, 'rb', buffering=buffer_size)
+
+# file names an entry can be stored under in pdb_dir, in order of preference. mmCIF is only used for entries
+# that don't exist in the legacy pdb format
+entry_extensions = ['.pdb.gz', '.pdb', '.cif.gz', '.cif']
+
+def pdb_file_name(pdb_dir: str, protein_name: str):
+    # path of an entry in pdb_dir, <id>.pdb if the entry isn't there in any format
+    for extension in entry_extensions:
+        file_name = pdb_dir + '/{}{}'.format(protein_name, extension)
+        if os.path.exists(file_name):
+            return file_name
+    return pdb_dir + '/{}.pdb'.format(protein_name)
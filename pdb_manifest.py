@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+
+def file_checksum(file_name: str):
+    # sha1 of the raw bytes of a file (gzipped files are hashed as stored)
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+# record of what a corpus was built from, kept next to it as <corpus>.manifest.json: the cull list, the parser
+# version, the chains in the corpus and for every entry the source file with its size, mtime and checksum.
+# pdb_parser.sync_corpus diffs a new cull list against it to find the chains to add and drop, and the entries
+# whose file changed since they were parsed
+class pdb_manifest():
+    def __init__(self, path: str):
+        self.path = path
+        self.cull_list = None
+        self.parser_version = None
+        self.chains = list()
+        self.entries = dict()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            self.cull_list = manifest['cull_list']
+            self.parser_version = manifest['parser_version']
+            self.chains = manifest['chains']
+            self.entries = manifest['entries']
+
+    def record_entry(self, protein_name: str, file_name: str):
+        st = os.stat(file_name)
+        self.entries[protein_name] = {'file': file_name, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                                      'sha1': file_checksum(file_name)}
+
+    def is_unchanged(self, protein_name: str, file_name: str):
+        # whether file_name is the file protein_name was parsed from. the checksum is only computed when size
+        # or mtime differ, a file that was just touched counts as unchanged
+        entry = self.entries.get(protein_name)
+        if entry is None or entry['file'] != file_name or not os.path.exists(file_name):
+            return False
+        st = os.stat(file_name)
+        if st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']:
+            return True
+        if st.st_size != entry['size'] or file_checksum(file_name) != entry['sha1']:
+            return False
+        entry['mtime_ns'] = st.st_mtime_ns
+        return True
+
+    def diff(self, l_pdb_name: list):
+        # (added, removed, kept) chains of a new cull list, added and kept in the order of l_pdb_name
+        old = set(self.chains)
+        new = set(l_pdb_name)
+        added = [pdb_name for pdb_name in l_pdb_name if pdb_name not in old]
+        removed = [pdb_name for pdb_name in self.chains if pdb_name not in new]
+        kept = [pdb_name for pdb_name in l_pdb_name if pdb_name in old]
+        return added, removed, kept
+
+    def save(self):
+        # entries no chain refers to any more are dropped
+        used = {pdb_name[:4] for pdb_name in self.chains}
+        manifest = {'cull_list': self.cull_list,
+                    'parser_version': self.parser_version,
+                    'chains': self.chains,
+                    'entries': {name: entry for name, entry in sorted(self.entries.items()) if name in used}}
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(self.path + '.tmp', self.path)
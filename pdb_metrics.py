@@ -0,0 +1,131 @@
+import json
+import platform
+import threading
+import time
+
+# per stage timers and counters for long runs of pdb_parser and pdb_utilities.
+# everything reports to the process wide instance `metrics` below, which starts out disabled: timer() then hands
+# back a shared no-op context manager and add() returns right away, so the instrumented code pays one function
+# call per stage. enable it with metrics.enable() (or pdb_parser(..., instrument=True)), read the numbers with
+# metrics.snapshot() and write them out with metrics.dump('metrics.json').
+# parse worker processes collect their own metrics and send them back to be merged into the parent's.
+class null_timer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class stage_timer():
+    def __init__(self, metrics, stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+_null_timer = null_timer()
+
+def current_rss_mb():
+    # peak resident set size of the process so far (ru_maxrss is in kilobytes on linux and bytes on macos),
+    # None where the resource module doesn't exist (windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 / (1024 if platform.system() == 'Darwin' else 1)
+
+class pdb_metrics():
+    def __init__(self):
+        self.enabled = False
+        self.sample_rss = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def enable(self, sample_rss: bool=False):
+        # sample_rss records the peak rss seen at the end of every stage, where the platform can report it
+        self.enabled = True
+        self.sample_rss = sample_rss and current_rss_mb() is not None
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        # {stage: [calls, seconds, max seconds, peak rss mb]}
+        self.timers = dict()
+        self.counters = dict()
+
+    def timer(self, stage: str):
+        if not self.enabled:
+            return _null_timer
+        return stage_timer(self, stage)
+
+    def record(self, stage: str, seconds: float):
+        rss = current_rss_mb() if self.sample_rss else 0.0
+        with self.lock:
+            timer = self.timers.get(stage)
+            if timer is None:
+                timer = self.timers[stage] = [0, 0.0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            timer[3] = max(timer[3], rss)
+
+    def add(self, name: str, value: int=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            timers = {stage: {'calls': calls, 'seconds': seconds, 'max_seconds': max_seconds}
+                      for stage, (calls, seconds, max_seconds, _) in sorted(self.timers.items())}
+            if self.sample_rss:
+                for stage, timer in self.timers.items():
+                    timers[stage]['peak_rss_mb'] = timer[3]
+            snapshot = {'timers': timers, 'counters': dict(sorted(self.counters.items()))}
+        if self.sample_rss:
+            snapshot['peak_rss_mb'] = current_rss_mb()
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        # adds the snapshot of another process (e.g. a parse worker) to this one
+        if not snapshot:
+            return
+        with self.lock:
+            for stage, t in snapshot['timers'].items():
+                timer = self.timers.get(stage)
+                if timer is None:
+                    timer = self.timers[stage] = [0, 0.0, 0.0, 0.0]
+                timer[0] += t['calls']
+                timer[1] += t['seconds']
+                timer[2] = max(timer[2], t['max_seconds'])
+                timer[3] = max(timer[3], t.get('peak_rss_mb', 0.0))
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def dump(self, file_name: str):
+        with open(file_name, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def print_report(self):
+        snapshot = self.snapshot()
+        for stage, t in snapshot['timers'].items():
+            print('{:24s} {:>8d} calls {:>10.3f}s (max {:.3f}s)'.format(stage, t['calls'], t['seconds'], t['max_seconds']))
+        for name, value in snapshot['counters'].items():
+            print('{:24s} {:>14}'.format(name, value))
+        if 'peak_rss_mb' in snapshot:
+            print('{:24s} {:>11.1f} MB'.format('peak rss', snapshot['peak_rss_mb']))
+
+    def worker_args(self):
+        # arguments to set up the same metrics in a worker process, None if disabled
+        return (self.sample_rss,) if self.enabled else None
+
+metrics = pdb_metrics()
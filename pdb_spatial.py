@@ -0,0 +1,122 @@
+import numpy as np
+import itertools
+
+# cell list over atom coordinates for radius and k nearest neighbour queries, numpy only.
+# space is cut into cubes of cell_size angstroms and the points are sorted by the key of the cell they fall into,
+# so the points of any cell are one contiguous slice found with np.searchsorted. groups (e.g. chain codes) are
+# part of the cell key, which gives one independent grid per chain inside a single index: queries only ever
+# see points of their own group. building is one sort and a query touches only the cells around each point,
+# so the cost grows linearly with the number of atoms instead of quadratically.
+# points with nan coordinates are left out
+class spatial_index():
+    def __init__(self, xyz: np.ndarray, groups: np.ndarray=None, cell_size: float=8.0):
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        groups = np.zeros(len(xyz), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+        self.cell_size = cell_size
+        self.xyz = xyz
+
+        rows = np.flatnonzero(np.isfinite(xyz).all(axis=1))
+        if len(rows):
+            self.lower = xyz[rows].min(axis=0)
+            self.upper = xyz[rows].max(axis=0)
+        else:
+            self.lower = self.upper = np.zeros(3)
+        self.shape = np.floor((self.upper - self.lower) / cell_size).astype(np.int64) + 1
+
+        keys = self.cell_key(groups[rows], self.cell(xyz[rows]))
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        # rows of xyz sorted by cell
+        self.rows = rows[order]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def cell(self, xyz: np.ndarray):
+        return np.floor((xyz - self.lower) / self.cell_size).astype(np.int64)
+
+    def cell_key(self, groups: np.ndarray, cells: np.ndarray):
+        return ((groups * self.shape[0] + cells[:, 0]) * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    def query_radius(self, xyz: np.ndarray, radius: float, groups: np.ndarray=None, sort: bool=True):
+        # all (query, row, distance) with row a point of the query's group within radius of the query point.
+        # query and row are positions in the arrays passed in, sorted by query and then distance unless sort=False
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        groups = np.zeros(len(xyz), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+        # queries with a nan coordinate or a negative group find nothing
+        finite = np.isfinite(xyz).all(axis=1) & (groups >= 0)
+        cells = self.cell(np.where(finite[:, None], xyz, self.lower))
+        groups = np.maximum(groups, 0)
+        span = int(np.ceil(radius / self.cell_size))
+
+        l_query, l_row, l_distance = list(), list(), list()
+        for offset in itertools.product(range(-span, span + 1), repeat=3):
+            neighbour = cells + np.array(offset)
+            valid = finite & np.all((neighbour >= 0) & (neighbour < self.shape), axis=1)
+            keys = self.cell_key(groups, np.where(valid[:, None], neighbour, 0))
+            start = np.searchsorted(self.keys, keys, side='left')
+            counts = np.where(valid, np.searchsorted(self.keys, keys, side='right') - start, 0)
+            if not counts.any():
+                continue
+
+            # every (query, point) pair of the cell, laid out flat
+            query = np.repeat(np.arange(len(xyz)), counts)
+            pos = start[query] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            row = self.rows[pos]
+            distance = np.linalg.norm(self.xyz[row] - xyz[query], axis=1)
+            close = distance <= radius
+            l_query.append(query[close])
+            l_row.append(row[close])
+            l_distance.append(distance[close])
+
+        if not l_query:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        query, row, distance = np.concatenate(l_query), np.concatenate(l_row), np.concatenate(l_distance)
+        if not sort:
+            return query, row, distance
+        order = np.lexsort((row, distance, query))
+        return query[order], row[order], distance[order]
+
+    def query_knn(self, xyz: np.ndarray, k: int, groups: np.ndarray=None):
+        # (rows, distances) of the k nearest points of the query's group, both (n, k) and sorted by distance.
+        # padded with -1 and inf where a group has fewer than k points.
+        # the search radius starts at one cell and doubles for the queries that haven't found k points yet
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        groups = np.zeros(len(xyz), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+        rows = np.full((len(xyz), k), -1, dtype=np.int64)
+        distances = np.full((len(xyz), k), np.inf)
+
+        # no point of the index is further away than the far corner of its bounding box
+        bound = np.linalg.norm(np.maximum(np.abs(xyz - self.lower), np.abs(xyz - self.upper)), axis=1)
+        pending = np.flatnonzero(np.isfinite(bound))
+        radius = self.cell_size
+        while len(pending):
+            query, row, distance = self.query_radius(xyz[pending], radius, groups[pending])
+            counts = np.bincount(query, minlength=len(pending))
+            done = (counts >= k) | (bound[pending] <= radius)
+
+            # query_radius sorts by distance, so the first k of every query are its nearest
+            rank = np.arange(len(query)) - np.repeat(np.cumsum(counts) - counts, counts)
+            take = done[query] & (rank < k)
+            rows[pending[query[take]], rank[take]] = row[take]
+            distances[pending[query[take]], rank[take]] = distance[take]
+
+            pending = pending[~done]
+            radius *= 2
+        return rows, distances
+
+    def pairs(self, radius: float, block_size: int=1 << 16):
+        # all pairs of points (row_i < row_j) of the same group within radius of each other, found block_size
+        # points at a time to bound memory. the group of an indexed point is recovered from its cell key
+        groups = self.keys // np.prod(self.shape)
+        l_i, l_j, l_distance = list(), list(), list()
+        for start in range(0, len(self.rows), block_size):
+            rows = self.rows[start:start + block_size]
+            query, row, distance = self.query_radius(self.xyz[rows], radius, groups[start:start + block_size], sort=False)
+            keep = rows[query] < row
+            l_i.append(rows[query][keep])
+            l_j.append(row[keep])
+            l_distance.append(distance[keep])
+        if not l_i:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(l_i), np.concatenate(l_j), np.concatenate(l_distance)
@@ -0,0 +1,155 @@
+import numpy as np
+
+# batched kabsch superposition and rmsd of equal length segments (e.g. the CA or N/CA/C atoms of helix and
+# strand windows from pdb_utilities.build_segments), numpy only.
+# segments are stacked as (n, n_atoms, 3) arrays and centered once. the rmsd after optimal superposition only
+# needs the largest eigenvalue of the qcp key matrix built from the 3x3 covariance of each pair, so the
+# covariances of a whole block of pairs come out of one matrix product and the eigenvalues of all of them are
+# found with a few vectorized newton steps, no svd per pair.
+# pairs are computed block_size x block_size at a time to bound memory, on a pool of processes if n_workers > 1
+
+def center(coords: np.ndarray):
+    # (centered coordinates, centroids) of a stack of segments
+    coords = np.asarray(coords, dtype=np.float64)
+    centroid = coords.mean(axis=1)
+    return coords - centroid[:, None, :], centroid
+
+def largest_eigenvalue(h: np.ndarray, e0: np.ndarray, tolerance: float=1e-11, max_iterations: int=50):
+    # largest eigenvalue of the 4x4 key matrix of the quaternion characteristic polynomial (qcp, Theobald 2005)
+    # of covariances h (..., 3, 3), found with newton steps from e0 (half the summed squared norms, an upper
+    # bound). it equals s1 + s2 + sign(det h) * s3 of the singular values, without any svd
+    sxx, sxy, sxz = h[..., 0, 0], h[..., 0, 1], h[..., 0, 2]
+    syx, syy, syz = h[..., 1, 0], h[..., 1, 1], h[..., 1, 2]
+    szx, szy, szz = h[..., 2, 0], h[..., 2, 1], h[..., 2, 2]
+    sxx2, syy2, szz2 = sxx * sxx, syy * syy, szz * szz
+    sxy2, syz2, sxz2 = sxy * sxy, syz * syz, sxz * sxz
+    syx2, szy2, szx2 = syx * syx, szy * szy, szx * szx
+
+    syzszymsyyszz2 = 2.0 * (syz * szy - syy * szz)
+    sxx2syy2szz2syz2szy2 = syy2 + szz2 - sxx2 + syz2 + szy2
+    c2 = -2.0 * (sxx2 + syy2 + szz2 + sxy2 + syx2 + sxz2 + szx2 + syz2 + szy2)
+    c1 = 8.0 * (sxx * syz * szy + syy * szx * sxz + szz * sxy * syx -
+                sxx * syy * szz - syz * szx * sxy - szy * syx * sxz)
+    sxzpszx, syzpszy, sxypsyx = sxz + szx, syz + szy, sxy + syx
+    syzmszy, sxzmszx, sxymsyx = syz - szy, sxz - szx, sxy - syx
+    sxxpsyy, sxxmsyy = sxx + syy, sxx - syy
+    sxy2sxz2syx2szx2 = sxy2 + sxz2 - syx2 - szx2
+    c0 = (sxy2sxz2syx2szx2 * sxy2sxz2syx2szx2 +
+          (sxx2syy2szz2syz2szy2 + syzszymsyyszz2) * (sxx2syy2szz2syz2szy2 - syzszymsyyszz2) +
+          (-sxzpszx * syzmszy + sxymsyx * (sxxmsyy - szz)) * (-sxzmszx * syzpszy + sxymsyx * (sxxmsyy + szz)) +
+          (-sxzpszx * syzpszy - sxypsyx * (sxxpsyy - szz)) * (-sxzmszx * syzmszy - sxypsyx * (sxxpsyy + szz)) +
+          (sxypsyx * syzpszy + sxzpszx * (sxxmsyy + szz)) * (-sxymsyx * syzmszy + sxzpszx * (sxxpsyy + szz)) +
+          (sxypsyx * syzmszy + sxzmszx * (sxxmsyy - szz)) * (-sxymsyx * syzpszy + sxzmszx * (sxxpsyy - szz)))
+
+    eigenvalue = np.array(e0, dtype=np.float64)
+    for _ in range(max_iterations):
+        x2 = eigenvalue * eigenvalue
+        b = (x2 + c2) * eigenvalue
+        a = b + c1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.nan_to_num((a * eigenvalue + c0) / (2.0 * x2 * eigenvalue + b + a))
+        eigenvalue -= delta
+        if np.all(np.abs(delta) <= tolerance * np.abs(eigenvalue)):
+            break
+    return eigenvalue
+
+def block_rmsd(a: np.ndarray, norm_a: np.ndarray, b: np.ndarray, norm_b: np.ndarray):
+    # (len(a), len(b)) rmsd after superposition of every centered segment of a onto every one of b,
+    # norm_a/norm_b are the sums of squared coordinates of the segments
+    n, n_atoms, _ = a.shape
+    m = len(b)
+    # covariance a_i^T b_j of all pairs as a single matrix product
+    h = a.transpose(0, 2, 1).reshape(n * 3, n_atoms) @ b.transpose(1, 0, 2).reshape(n_atoms, m * 3)
+    h = h.reshape(n, 3, m, 3).transpose(0, 2, 1, 3)
+    e0 = (norm_a[:, None] + norm_b[None, :]) / 2
+    msd = 2 * (e0 - largest_eigenvalue(h, e0)) / n_atoms
+    return np.sqrt(np.maximum(msd, 0))
+
+def superpose(mobile: np.ndarray, target: np.ndarray):
+    # best fit of every mobile segment onto the target segment at the same position, both (n, n_atoms, 3).
+    # returns (rotation, translation, rmsd) with mobile[i] @ rotation[i] + translation[i] ~ target[i]
+    a, centroid_a = center(mobile)
+    b, centroid_b = center(target)
+    u, s, vt = np.linalg.svd(np.einsum('nki,nkj->nij', a, b))
+    d = np.sign(np.linalg.det(u @ vt))
+    u[:, :, 2] *= d[:, None]
+    rotation = u @ vt
+    translation = centroid_b - np.einsum('ni,nij->nj', centroid_a, rotation)
+    rmsd = np.sqrt(np.mean(np.sum((a @ rotation - b) ** 2, axis=2), axis=1))
+    return rotation, translation, rmsd
+
+# per process state of the workers of pairwise_rmsd and reference_rmsd
+_worker_a = None
+_worker_norm_a = None
+_worker_b = None
+_worker_norm_b = None
+
+def _init_rmsd_worker(a: np.ndarray, norm_a: np.ndarray, b: np.ndarray, norm_b: np.ndarray):
+    global _worker_a, _worker_norm_a, _worker_b, _worker_norm_b
+    _worker_a, _worker_norm_a, _worker_b, _worker_norm_b = a, norm_a, b, norm_b
+
+def _rmsd_block_worker(args):
+    i, j, block_size, threshold = args
+    rmsd = block_rmsd(_worker_a[i:i + block_size], _worker_norm_a[i:i + block_size],
+                      _worker_b[j:j + block_size], _worker_norm_b[j:j + block_size])
+    if threshold is None:
+        return i, j, rmsd
+    # only the pairs i < j within threshold, as positions in the full arrays
+    row, column = np.nonzero(rmsd <= threshold)
+    keep = row + i < column + j
+    return i, j, (row[keep] + i, column[keep] + j, rmsd[row[keep], column[keep]])
+
+def map_blocks(tasks: list, a: np.ndarray, norm_a: np.ndarray, b: np.ndarray, norm_b: np.ndarray, n_workers: int=1):
+    # results of _rmsd_block_worker for every task, in completion order
+    if n_workers <= 1:
+        _init_rmsd_worker(a, norm_a, b, norm_b)
+        try:
+            for task in tasks:
+                yield _rmsd_block_worker(task)
+        finally:
+            _init_rmsd_worker(None, None, None, None)
+        return
+
+    from multiprocessing import Pool
+    with Pool(n_workers, initializer=_init_rmsd_worker, initargs=(a, norm_a, b, norm_b)) as p:
+        for result in p.imap_unordered(_rmsd_block_worker, tasks):
+            yield result
+
+def pairwise_rmsd(coords: np.ndarray, block_size: int=512, n_workers: int=1, threshold: float=None):
+    # rmsd after superposition between all pairs of segments of coords (n, n_atoms, 3).
+    # returns the (n, n) matrix, or with threshold only the pairs (i, j, rmsd) with i < j and rmsd <= threshold,
+    # which is what clustering needs and doesn't hold n^2 numbers in memory
+    a, _ = center(coords)
+    norm = np.sum(a ** 2, axis=(1, 2))
+    n = len(a)
+    tasks = [(i, j, block_size, threshold) for i in range(0, n, block_size) for j in range(i, n, block_size)]
+
+    if threshold is None:
+        matrix = np.zeros((n, n))
+        for i, j, rmsd in map_blocks(tasks, a, norm, a, norm, n_workers):
+            matrix[i:i + block_size, j:j + block_size] = rmsd
+            matrix[j:j + block_size, i:i + block_size] = rmsd.T
+        np.fill_diagonal(matrix, 0)
+        return matrix
+
+    # no blocks at all for an empty input
+    l_i, l_j, l_rmsd = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for _, _, (i, j, rmsd) in map_blocks(tasks, a, norm, a, norm, n_workers):
+        l_i.append(i)
+        l_j.append(j)
+        l_rmsd.append(rmsd)
+    i, j, rmsd = np.concatenate(l_i), np.concatenate(l_j), np.concatenate(l_rmsd)
+    order = np.lexsort((j, i))
+    return i[order], j[order], rmsd[order]
+
+def reference_rmsd(coords: np.ndarray, references: np.ndarray, block_size: int=512, n_workers: int=1):
+    # (n, m) rmsd after superposition of every segment of coords (n, n_atoms, 3) onto every reference (m, n_atoms, 3)
+    a, _ = center(coords)
+    b, _ = center(references)
+    norm_a = np.sum(a ** 2, axis=(1, 2))
+    norm_b = np.sum(b ** 2, axis=(1, 2))
+    tasks = [(i, j, block_size, None) for i in range(0, len(a), block_size) for j in range(0, len(b), block_size)]
+    matrix = np.zeros((len(a), len(b)))
+    for i, j, rmsd in map_blocks(tasks, a, norm_a, b, norm_b, n_workers):
+        matrix[i:i + block_size, j:j + block_size] = rmsd
+    return matrix
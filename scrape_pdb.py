@@ -1,8 +1,18 @@
-import requests
-import json
 import numpy as np
 import pandas as pd
+import hashlib
 import os
+from pdb_cache import pdb_cache
+from pdb_download import pdb_downloader
+from pdb_corpus import corpus_writer, pdb_corpus, corpus_required
+from pdb_manifest import pdb_manifest
+from pdb_dataset import write_table, read_table
+from pdb_io import open_maybe_gzip, pdb_file_name
+from pdb_cif import read_cif_categories, cif_column
+from pdb_metrics import metrics
+
+# bump whenever a change to the parser changes its output so stale entries in pdb_cache are re-parsed
+parser_version = 1
 
 format_spacing = {
     'ATOM' : { 
@@ -30,51 +40,302 @@ format_spacing = {
     }
 }
 
+# types of the fixed-width fields above. anything not listed here is kept as a string.
+# 'Int' marks integer fields that may be left blank (e.g. registration of the first strand of a sheet)
+format_types = {
+    'ATOM' : {'serial_number': 'int', 'res_seq': 'int',
+              'x': 'float', 'y': 'float', 'z': 'float',
+              'occupancy': 'float', 'tempFactor': 'float'},
+    'HELIX' : {'serial_number': 'int', 'init_seq_num': 'int', 'end_seq_num': 'int', 'length': 'Int'},
+    'SHEET' : {'strand': 'int', 'num_strands': 'int', 'init_seq_num': 'int', 'end_seq_num': 'int',
+               'sense': 'int', 'cur_res_seq': 'Int', 'prev_res_seq': 'Int'}
+}
+
+# dtypes of the columns in df_atom, df_helix and df_sheet. strings with few distinct values are stored as
+# categoricals, every other column keeps the type it is parsed with
+table_dtypes = {
+    'ATOM' : {'serial_number': np.int32, 'res_seq': np.int32,
+              'x': np.float32, 'y': np.float32, 'z': np.float32,
+              'occupancy': np.float32, 'tempFactor': np.float32,
+              'record_name': 'category', 'atom_name': 'category', 'alt_loc': 'category',
+              'res_name': 'category', 'chain_id': 'category', 'iCode': 'category',
+              'element': 'category', 'charge': 'category', 'protein_name': 'category'},
+    'HELIX' : {'serial_number': np.int32, 'init_seq_num': np.int32, 'end_seq_num': np.int32, 'length': 'Int32',
+               'record_name': 'category', 'init_res_name': 'category', 'init_chain_id': 'category',
+               'end_res_name': 'category', 'end_chain_id': 'category', 'helix_class': 'category',
+               'protein_name': 'category'},
+    'SHEET' : {'strand': np.int32, 'num_strands': np.int32, 'init_seq_num': np.int32, 'end_seq_num': np.int32,
+               'sense': np.int32, 'cur_res_seq': 'Int32', 'prev_res_seq': 'Int32',
+               'record_name': 'category', 'init_res_name': 'category', 'init_chain_id': 'category',
+               'end_res_name': 'category', 'end_chain_id': 'category', 'cur_atom': 'category',
+               'cur_res_name': 'category', 'cur_chain_id': 'category', 'prev_atom': 'category',
+               'prev_res_name': 'category', 'prev_chain_id': 'category', 'protein_name': 'category'}
+}
+
+# mmCIF items read into the columns of format_spacing by pdb_parser.parse_cif_entry (author numbering and
+# chain ids, like the legacy pdb format). columns not listed here are filled in by parse_cif_entry or left blank
+cif_mapping = {
+    'ATOM' : {'category': '_atom_site',
+              'columns': {'record_name': 'group_PDB', 'serial_number': 'id', 'atom_name': 'auth_atom_id',
+                          'alt_loc': 'label_alt_id', 'res_name': 'auth_comp_id', 'chain_id': 'auth_asym_id',
+                          'res_seq': 'auth_seq_id', 'iCode': 'pdbx_PDB_ins_code',
+                          'x': 'Cartn_x', 'y': 'Cartn_y', 'z': 'Cartn_z', 'occupancy': 'occupancy',
+                          'tempFactor': 'B_iso_or_equiv', 'element': 'type_symbol', 'charge': 'pdbx_formal_charge'}},
+    'HELIX' : {'category': '_struct_conf',
+               'columns': {'helix_id': 'pdbx_PDB_helix_id', 'init_res_name': 'beg_auth_comp_id',
+                           'init_chain_id': 'beg_auth_asym_id', 'init_seq_num': 'beg_auth_seq_id',
+                           'init_iCode': 'pdbx_beg_PDB_ins_code', 'end_res_name': 'end_auth_comp_id',
+                           'end_chain_id': 'end_auth_asym_id', 'end_seq_num': 'end_auth_seq_id',
+                           'end_iCode': 'pdbx_end_PDB_ins_code', 'helix_class': 'pdbx_PDB_helix_class',
+                           'comment': 'details', 'length': 'pdbx_PDB_helix_length'}},
+    'SHEET' : {'category': '_struct_sheet_range',
+               'columns': {'sheet_id': 'sheet_id', 'init_res_name': 'beg_auth_comp_id',
+                           'init_chain_id': 'beg_auth_asym_id', 'init_seq_num': 'beg_auth_seq_id',
+                           'init_iCode': 'pdbx_beg_PDB_ins_code', 'end_res_name': 'end_auth_comp_id',
+                           'end_chain_id': 'end_auth_asym_id', 'end_seq_num': 'end_auth_seq_id',
+                           'end_iCode': 'pdbx_end_PDB_ins_code'}}
+}
+
+# strand registration (SHEET cur_*/prev_* columns) from _pdbx_struct_sheet_hbond, range 2 is the current strand
+cif_registration = {'cur_atom': 'range_2_auth_atom_id', 'cur_res_name': 'range_2_auth_comp_id',
+                    'cur_chain_id': 'range_2_auth_asym_id', 'cur_res_seq': 'range_2_auth_seq_id',
+                    'cur_iCode': 'range_2_PDB_ins_code', 'prev_atom': 'range_1_auth_atom_id',
+                    'prev_res_name': 'range_1_auth_comp_id', 'prev_chain_id': 'range_1_auth_asym_id',
+                    'prev_res_seq': 'range_1_auth_seq_id', 'rev_iCode': 'range_1_PDB_ins_code'}
+
 atom_backchain = ['N', 'CA', 'C', 'O']
 
+# columns parse_chain splits entries into chains with, column projection always keeps them
+chain_columns = {'ATOM': ['chain_id'], 'HELIX': ['init_chain_id', 'end_chain_id'], 'SHEET': ['cur_chain_id']}
+
+def field_slice(keyword: str, label: str):
+    # byte range of a field in a fixed-width pdb line
+    l_label = format_spacing[keyword]['label']
+    l_spacing = format_spacing[keyword]['spacing']
+    i = l_label.index(label)
+    return slice(l_spacing[i - 1] if i else 0, l_spacing[i])
+
+# what pdb_parser reads out of every entry: the record types, ATOM lines by atom and residue name (e.g.
+# atom_names=atom_backchain) and the columns of every record type (a list for all record types or a
+# {record name: columns} dict). it is applied while the file is read, so filtered lines are never sliced or
+# converted and projected columns are never sliced at all. None selects everything
+class pdb_selection():
+    def __init__(self, records: list=None, atom_names: list=None, res_names: list=None, columns=None):
+        self.records = [keyword for keyword in format_spacing if records is None or keyword in records]
+        self.atom_names = None if atom_names is None else sorted(set(atom_names))
+        self.res_names = None if res_names is None else sorted(set(res_names))
+        self.columns = dict()
+        for keyword in self.records:
+            wanted = columns.get(keyword) if isinstance(columns, dict) else columns
+            self.columns[keyword] = [label for label in format_spacing[keyword]['label']
+                                     if wanted is None or label in wanted or label in chain_columns[keyword]]
+
+        self.atom_set = None if self.atom_names is None else {name.encode() for name in self.atom_names}
+        self.res_set = None if self.res_names is None else {name.encode() for name in self.res_names}
+        self.atom_slice = field_slice('ATOM', 'atom_name')
+        self.res_slice = field_slice('ATOM', 'res_name')
+
+    def is_everything(self):
+        return self.records == list(format_spacing) and self.atom_names is None and self.res_names is None and \
+            all(self.columns[keyword] == format_spacing[keyword]['label'] for keyword in self.records)
+
+    def key(self):
+        # short name of the selection, parsed entries are cached separately for every selection
+        return hashlib.md5(repr((self.records, self.atom_names, self.res_names, self.columns)).encode()).hexdigest()[:12]
+
+    def keep_atom(self, line: bytes):
+        if self.atom_set is not None and line[self.atom_slice].strip() not in self.atom_set:
+            return False
+        return self.res_set is None or line[self.res_slice].strip() in self.res_set
+
+    def atom_mask(self, atom_name: np.ndarray, res_name: np.ndarray):
+        # same as keep_atom on parsed (e.g. mmCIF) columns
+        keep = np.ones(len(atom_name), dtype=bool)
+        if self.atom_names is not None:
+            keep &= np.isin(atom_name, self.atom_names)
+        if self.res_names is not None:
+            keep &= np.isin(res_name, self.res_names)
+        return keep
+
+def convert_field(field: np.ndarray, typ: str=None):
+    # converts a column of stripped bytes or str values to the type named in format_types
+    if typ is None:
+        return np.char.decode(field, 'ascii') if field.dtype.kind == 'S' else field.astype(str)
+
+    blank = field == field.dtype.type()
+    if typ == 'float':
+        values = np.full(len(field), np.nan)
+        values[~blank] = field[~blank].astype(np.float64)
+    else:
+        values = np.zeros(len(field), dtype=np.int64)
+        values[~blank] = field[~blank].astype(np.int64)
+        if typ == 'Int':
+            values = pd.arrays.IntegerArray(values, blank)
+    return values
+
+# columnar table that parsed chunks (dicts of column arrays from pdb_parser.parse_pdb_block) are appended to.
+# chunks are converted to the compact dtypes in table_dtypes as they come in and are only concatenated once
+# in to_frame, so appending never copies what is already stored. categorical columns are kept as integer
+# codes into a vocabulary shared by all chunks.
+class pdb_table():
+    def __init__(self, keyword: str, labels: list=None):
+        # labels are the columns to keep (all of format_spacing by default)
+        self.keyword = keyword
+        self.labels = list(format_spacing[keyword]['label'] if labels is None else labels) + ['protein_name']
+        self.dtypes = table_dtypes[keyword]
+        self.chunks = list()
+        self.categories = {label: dict() for label, dtype in self.dtypes.items() if dtype == 'category'}
+        self.n_rows = 0
+
+    def __len__(self):
+        return self.n_rows
+
+    def append(self, columns: dict, protein_name: str=None):
+        # protein_name, if given, fills the protein_name column of the whole chunk
+        chunk = dict()
+        if protein_name is not None:
+            columns = dict(columns, protein_name=np.full(len(columns[self.labels[0]]), protein_name))
+        for label in self.labels:
+            values = columns[label]
+            dtype = self.dtypes.get(label)
+            if dtype == 'category':
+                vocabulary = self.categories[label]
+                uniques, inverse = np.unique(values, return_inverse=True)
+                codes = np.array([vocabulary.setdefault(u, len(vocabulary)) for u in uniques], dtype=np.int32)
+                chunk[label] = codes[inverse.ravel()]
+            elif dtype is not None:
+                chunk[label] = values.astype(dtype)
+            else:
+                chunk[label] = values
+        self.chunks.append(chunk)
+        self.n_rows += len(chunk[self.labels[0]])
+
+    def to_frame(self):
+        with metrics.timer('merge.' + self.keyword):
+            return self.concatenate()
+
+    def concatenate(self):
+        data = dict()
+        for label in self.labels:
+            l_values = [chunk[label] for chunk in self.chunks]
+            dtype = self.dtypes.get(label)
+            if dtype == 'category':
+                codes = np.concatenate(l_values) if l_values else np.array([], dtype=np.int32)
+                data[label] = pd.Categorical.from_codes(codes, categories=list(self.categories[label]))
+            elif dtype in ('Int32', 'Int64'):
+                data[label] = pd.concat([pd.Series(values) for values in l_values], ignore_index=True) \
+                    if l_values else pd.array([], dtype=dtype)
+            else:
+                data[label] = np.concatenate(l_values) if l_values else np.array([], dtype=dtype or str)
+        return pd.DataFrame(data)
+
+def select_rows(columns: dict, mask):
+    return {label: values[mask] for label, values in columns.items()}
+
+# per process state of the parse workers used by pdb_parser.process_all_pdb_parallel
+_worker_pdb_dir = None
+_worker_cache = None
+_worker_selection = None
+
+def _init_parse_worker(pdb_dir: str, cache_args: tuple, metrics_args: tuple=None, selection: pdb_selection=None):
+    global _worker_pdb_dir, _worker_cache, _worker_selection
+    _worker_pdb_dir = pdb_dir
+    _worker_selection = selection
+    _worker_cache = pdb_cache(*cache_args) if cache_args else None
+    if metrics_args:
+        metrics.enable(*metrics_args)
+
+def group_entries(l_pdb: list):
+    # [(protein_name, [(index, pdb_name), ...]), ...] with the cull list chains of every entry together, entries
+    # in the order they first appear in l_pdb. pisces lists the chains of an entry next to each other anyway
+    groups = dict()
+    for index, pdb_name in enumerate(l_pdb):
+        groups.setdefault(pdb_name[:4], list()).append((index, pdb_name))
+    return list(groups.items())
+
+def _parse_entry_worker(args):
+    # parses the file of one entry once and splits it into the chains of the cull list that belong to it
+    protein_name, l_index_pdb = args
+    hits, misses = (_worker_cache.hits, _worker_cache.misses) if _worker_cache else (0, 0)
+    l_chain = pdb_parser.parse_entry_chains(protein_name, [pdb_name[4:] for _, pdb_name in l_index_pdb],
+                                            _worker_pdb_dir, _worker_cache, _worker_selection)
+    if _worker_cache:
+        hits, misses = _worker_cache.hits - hits, _worker_cache.misses - misses
+    # metrics of this entry only, they get merged into the parent's
+    snapshot = None
+    if metrics.enabled:
+        snapshot = metrics.snapshot()
+        metrics.reset()
+    return [index for index, _ in l_index_pdb], l_chain, hits, misses, snapshot
+
 # parser class that should read list of pdbs.
 # It first collects pdb files and then parse them into df_atom, df_helix, and df_sheet
 # df_atom contains all atom information including each of their coordinates
 # df_helix contains helix information
 # df_sheet contains sheet information
 class pdb_parser():
-    def __init__(self, index_to_break: int=-1, flag=True):
+    def __init__(self, index_to_break: int=-1, flag=True, cache_dir: str='./pdb_cache', cache_size_mb: float=4096,
+                 n_workers: int=1, base_url: str='https://files.rcsb.org/view', n_downloads: int=16,
+                 lazy: bool=False, instrument: bool=False, records: list=None, atom_names: list=None,
+                 res_names: list=None, columns=None, max_resolution: float=None, max_r_factor: float=None,
+                 exptl: list=None, min_length: int=None, max_length: int=None, pipeline: bool=True,
+                 queue_size: int=64):
+        # instrument=True turns on the stage timers and counters of pdb_metrics (see print_stats)
+        if instrument:
+            metrics.enable(sample_rss=True)
         self.df_atom = pd.DataFrame()
         self.df_sheet = pd.DataFrame()
         self.df_helix = pd.DataFrame()
         self.filename_list_pdb = 'cullpdb_pc30_res3.0_R1.0_d191017_chains18877.gz'
         self.df_pdb_list = self.parse_list_pdb(self.filename_list_pdb)
+        # cull list filters are applied before anything is downloaded
+        self.list_filters = {'max_resolution': max_resolution, 'max_r_factor': max_r_factor, 'exptl': exptl,
+                             'min_length': min_length, 'max_length': max_length}
+        self.df_pdb_list = self.filter_list_pdb(self.df_pdb_list, **self.list_filters)
         self.pdb_dir = './pdb_data'
-        self.l_atom = list()
-        self.l_sheet = list()
-        self.l_helix = list()
+        # records/atom_names/res_names/columns are pushed down into the parser, see pdb_selection
+        self.selection = pdb_selection(records, atom_names, res_names, columns)
+        if self.selection.is_everything():
+            self.selection = None
+        labels = self.selection.columns if self.selection is not None else dict()
+        self.t_atom = pdb_table('ATOM', labels.get('ATOM'))
+        self.t_helix = pdb_table('HELIX', labels.get('HELIX'))
+        self.t_sheet = pdb_table('SHEET', labels.get('SHEET'))
+        # parsed entries are cached on disk, pass cache_dir=None to always parse from the pdb files
+        self.cache = pdb_cache(cache_dir, parser_version, cache_size_mb) if cache_dir else None
+
+        self.downloader = pdb_downloader(self.pdb_dir, base_url, n_downloads)
+        # lazy=True skips the up front download and parse, chains are then read one by one with iter_chains
+        if lazy:
+            return
 
-        # using multithreading to download pdb files...
-        self.download_all_pdb(index_to_break)
         if index_to_break == -1:
             print('parsing all pdb in {}'.format(self.filename_list_pdb))
         else:
             print('parsing first {} proteins in {}'.format(index_to_break, self.filename_list_pdb))
 
-        for index, pdb in enumerate(list(self.df_pdb_list['IDs'])):
-            if index == index_to_break:
-                break
-            # self.process_pdb(pdb)
-            # flushing out list for memory...
-            if index%500 == 0 and index != 0:
-                print('completed parsing {} pdbs'.format(index))
-                self.df_atom = pd.concat([self.df_atom, pd.read_json(json.dumps(self.l_atom))], ignore_index=True)
-                self.df_helix = pd.concat([self.df_helix, pd.read_json(json.dumps(self.l_helix))], ignore_index=True)
-                self.df_sheet = pd.concat([self.df_sheet, pd.read_json(json.dumps(self.l_sheet))], ignore_index=True)
-                self.l_atom = list()
-                self.l_helix = list()
-                self.l_sheet = list()
-
-            self.process_pdb_new(pdb)
-        
-        self.df_atom = pd.concat([self.df_atom, pd.read_json(json.dumps(self.l_atom))], ignore_index=True).astype('str')
-        self.df_helix = pd.concat([self.df_helix, pd.read_json(json.dumps(self.l_helix))], ignore_index=True).astype('str')
-        self.df_sheet = pd.concat([self.df_sheet, pd.read_json(json.dumps(self.l_sheet))], ignore_index=True).astype('str')
+        # pipeline=True parses entries while the rest are still downloading (see process_all_pdb_pipelined),
+        # pipeline=False downloads everything first. n_workers > 1 parses chains in a pool of processes,
+        # output is the same as the serial loop either way
+        if pipeline:
+            self.process_all_pdb_pipelined(index_to_break, n_workers, queue_size)
+        else:
+            # using multithreading to download pdb files...
+            self.download_all_pdb(index_to_break)
+            if n_workers > 1:
+                self.process_all_pdb_parallel(index_to_break, n_workers)
+            else:
+                l_pdb = self._cull_list(index_to_break)
+                for index, (pdb, chain) in enumerate(self.parse_chains(l_pdb)):
+                    # self.process_pdb(pdb)
+                    if index%500 == 0 and index != 0:
+                        print('completed parsing {} pdbs'.format(index))
+
+                    self.append_chain(pdb, chain)
+
+        self.df_atom = self.t_atom.to_frame()
+        self.df_helix = self.t_helix.to_frame()
+        self.df_sheet = self.t_sheet.to_frame()
         
     def parse_pdb_data(self, str_pdb: str, keyword: str, pdb_name: str):
 
@@ -96,34 +357,492 @@ class pdb_parser():
                 tmp_dict['protein_name'] = pdb_name
                 return tmp_dict
 
+    @staticmethod
+    def read_pdb_records(file_name: str, selection: pdb_selection=None):
+        # reads a pdb file (plain or gzipped) once and groups its lines by record name (only the ones in format_spacing,
+        # or in the selection). ATOM lines not matching the atom/residue names of the selection are dropped here
+        keywords = format_spacing.keys() if selection is None else selection.records
+        records = {keyword.encode(): list() for keyword in keywords}
+        atom_lines = records.get(b'ATOM')
+        with metrics.timer('read'), open_maybe_gzip(file_name) as f:
+            data = f.read()
+            l_all_lines = data.splitlines()
+            if selection is None or (selection.atom_set is None and selection.res_set is None):
+                for line in l_all_lines:
+                    l_lines = records.get(line[:6].rstrip())
+                    if l_lines is not None:
+                        l_lines.append(line)
+            else:
+                for line in l_all_lines:
+                    l_lines = records.get(line[:6].rstrip())
+                    if l_lines is not None and (l_lines is not atom_lines or selection.keep_atom(line)):
+                        l_lines.append(line)
+        metrics.add('bytes_read', len(data))
+        metrics.add('lines_read', len(l_all_lines))
+
+        return {keyword.decode(): l_lines for keyword, l_lines in records.items()}
+
+    @staticmethod
+    def parse_pdb_block(l_lines: list, keyword: str, pdb_name: str=None, labels: list=None):
+        # bulk version of parse_pdb_data. all lines of one record type are packed into a
+        # fixed-width byte matrix so each field is sliced once for the whole block.
+        # returns a dict of column arrays typed according to format_types (plus protein_name if pdb_name is given)
+        with metrics.timer('parse.' + keyword):
+            columns = pdb_parser.slice_pdb_block(l_lines, keyword, labels)
+        metrics.add('records.' + keyword, len(l_lines))
+
+        if pdb_name is not None:
+            columns['protein_name'] = np.full(len(l_lines), pdb_name)
+        return columns
+
+    @staticmethod
+    def slice_pdb_block(l_lines: list, keyword: str, labels: list=None):
+        # labels limits the columns that are sliced out (all by default)
+        l_label = format_spacing[keyword]['label']
+        l_spacing = format_spacing[keyword]['spacing']
+        types = format_types[keyword]
+
+        if len(l_label) != len(l_spacing):
+            raise Exception('length of label and spacing for {} not matching'.format(keyword))
+
+        labels = l_label if labels is None else labels
+        # the block only has to reach the end of the last selected field
+        width = max(end for label, end in zip(l_label, l_spacing) if label in labels)
+        n_lines = len(l_lines)
+        # lines shorter than width are padded with null bytes which numpy drops from 'S' values
+        block = np.array(l_lines, dtype='S{}'.format(width)).view('S1').reshape(n_lines, width)
+
+        columns = dict()
+        start = 0
+        for label, end in zip(l_label, l_spacing):
+            if label in labels:
+                field = np.ascontiguousarray(block[:, start:end]).view('S{}'.format(end - start)).ravel()
+                columns[label] = convert_field(np.char.strip(field), types.get(label))
+            start = end
+        return columns
+
+    @staticmethod
+    def parse_pdb_entry(file_name: str, selection: pdb_selection=None):
+        # parses every chain of a pdb file into {record name: {column: array}}
+        records = pdb_parser.read_pdb_records(file_name, selection)
+        return {keyword: pdb_parser.parse_pdb_block(l_lines, keyword,
+                                                    labels=selection.columns[keyword] if selection else None)
+                for keyword, l_lines in records.items()}
+
+    @staticmethod
+    def parse_cif_entry(file_name: str, selection: pdb_selection=None):
+        # same as parse_pdb_entry for mmCIF files, for entries too large for the legacy format
+        # (more than 99,999 atoms or chain ids longer than one character)
+        with metrics.timer('read.cif'):
+            tables = read_cif_categories(file_name, ['_atom_site', '_struct_conf', '_struct_sheet_range', '_struct_sheet',
+                                                     '_struct_sheet_order', '_pdbx_struct_sheet_hbond'])
+        with metrics.timer('parse.cif'):
+            entry = pdb_parser.convert_cif_tables(tables, selection)
+        for keyword, columns in entry.items():
+            metrics.add('records.' + keyword, len(next(iter(columns.values()))))
+        return entry
+
+    @staticmethod
+    def convert_cif_tables(tables: dict, selection: pdb_selection=None):
+        entry = dict()
+        for keyword, mapping in cif_mapping.items():
+            if selection is not None and keyword not in selection.records:
+                continue
+            table = tables.get(mapping['category'], dict())
+            n_rows = len(next(iter(table.values()))) if table else 0
+            if keyword == 'HELIX' and n_rows:
+                # _struct_conf also lists turns
+                keep = np.char.startswith(table['conf_type_id'], 'HELX')
+                table = {item: values[keep] for item, values in table.items()}
+                n_rows = int(keep.sum())
+            elif keyword == 'ATOM' and n_rows:
+                keep = table['group_PDB'] == 'ATOM'
+                if selection is not None:
+                    keep &= selection.atom_mask(cif_column(table, mapping['columns']['atom_name'], n_rows),
+                                                cif_column(table, mapping['columns']['res_name'], n_rows))
+                table = {item: values[keep] for item, values in table.items()}
+                n_rows = int(keep.sum())
+
+            fields = {label: cif_column(table, mapping['columns'][label], n_rows) if label in mapping['columns']
+                      else np.full(n_rows, '', dtype=str) for label in format_spacing[keyword]['label']}
+            fields['record_name'] = np.full(n_rows, keyword)
+            if keyword == 'ATOM':
+                # formal charge is an integer in mmCIF, '2+' / '1-' in pdb files
+                charge = fields['charge']
+                fields['charge'] = np.where(np.isin(charge, ['', '0']), '',
+                                            np.char.add(np.char.lstrip(np.char.lstrip(charge, '-'), '+'),
+                                                        np.where(np.char.startswith(charge, '-'), '-', '+')))
+            elif keyword == 'HELIX':
+                fields['serial_number'] = np.arange(1, n_rows + 1).astype(str)
+            elif keyword == 'SHEET':
+                fields.update(pdb_parser.cif_sheet_fields(tables, table, n_rows))
+            labels = format_spacing[keyword]['label'] if selection is None else selection.columns[keyword]
+            entry[keyword] = {label: convert_field(fields[label], format_types[keyword].get(label)) for label in labels}
+        return entry
+
+    @staticmethod
+    def cif_sheet_fields(tables: dict, table: dict, n_rows: int):
+        # strand number, number of strands, sense and registration of every _struct_sheet_range row
+        sheet_id = cif_column(table, 'sheet_id', n_rows)
+        range_id = cif_column(table, 'id', n_rows)
+        fields = dict()
+
+        # strands are numbered in the order they are listed within their sheet
+        strand = np.zeros(n_rows, dtype=np.int64)
+        counts = dict()
+        for i, sheet in enumerate(sheet_id):
+            counts[sheet] = counts.get(sheet, 0) + 1
+            strand[i] = counts[sheet]
+        fields['strand'] = strand.astype(str)
+
+        sheet = tables.get('_struct_sheet', dict())
+        n_strands = dict(zip(cif_column(sheet, 'id', len(sheet.get('id', []))),
+                             cif_column(sheet, 'number_strands', len(sheet.get('id', [])))))
+        fields['num_strands'] = np.array([n_strands.get(s) or str(counts[s]) for s in sheet_id], dtype=str)
+
+        order = tables.get('_struct_sheet_order', dict())
+        n_order = len(order.get('sheet_id', []))
+        sense = dict(zip(zip(cif_column(order, 'sheet_id', n_order), cif_column(order, 'range_id_2', n_order)),
+                         cif_column(order, 'sense', n_order)))
+        fields['sense'] = np.array([{'parallel': '1', 'anti-parallel': '-1'}.get(sense.get(key), '0')
+                                    for key in zip(sheet_id, range_id)], dtype=str)
+
+        hbond = tables.get('_pdbx_struct_sheet_hbond', dict())
+        n_hbond = len(hbond.get('sheet_id', []))
+        rows = dict(zip(zip(cif_column(hbond, 'sheet_id', n_hbond), cif_column(hbond, 'range_id_2', n_hbond)),
+                        range(n_hbond)))
+        index = np.array([rows.get(key, -1) for key in zip(sheet_id, range_id)], dtype=np.int64)
+        for label, item in cif_registration.items():
+            values = np.append(cif_column(hbond, item, n_hbond), '')
+            fields[label] = values[index]
+        return fields
+
+    @staticmethod
+    def parse_entry(file_name: str, selection: pdb_selection=None):
+        if file_name.endswith(('.cif', '.cif.gz')):
+            return pdb_parser.parse_cif_entry(file_name, selection)
+        return pdb_parser.parse_pdb_entry(file_name, selection)
+
+    @staticmethod
+    def load_entry(protein_name: str, pdb_dir: str, cache: pdb_cache=None, selection: pdb_selection=None):
+        file_name = pdb_file_name(pdb_dir, protein_name)
+        if cache is None:
+            return pdb_parser.parse_entry(file_name, selection)
+
+        # entries parsed with a selection are cached under their own name
+        entry_name = protein_name if selection is None else '{}-{}'.format(protein_name, selection.key())
+        with metrics.timer('cache.load'):
+            entry = cache.load(entry_name, file_name)
+        if entry is None:
+            metrics.add('cache.misses')
+            entry = pdb_parser.parse_entry(file_name, selection)
+            with metrics.timer('cache.store'):
+                cache.store(entry_name, file_name, entry)
+        else:
+            metrics.add('cache.hits')
+        return entry
+
+    @staticmethod
+    def split_chains(entry: dict, l_chain_id: list):
+        # splits the columns of a parsed entry into one dict of ATOM, HELIX and SHEET columns per chain id.
+        # atoms are grouped with a single stable sort on chain_id, so every chain keeps its file order
+        l_chain = [dict() for _ in l_chain_id]
+        if 'ATOM' in entry:
+            atom = entry['ATOM']
+            chain_id = np.asarray(atom['chain_id'])
+            order = np.argsort(chain_id, kind='stable')
+            sorted_id = chain_id[order]
+            for chain, protein_chain in zip(l_chain, l_chain_id):
+                start = np.searchsorted(sorted_id, protein_chain, side='left')
+                stop = np.searchsorted(sorted_id, protein_chain, side='right')
+                chain['ATOM'] = select_rows(atom, order[start:stop])
+        if 'HELIX' in entry:
+            helix = entry['HELIX']
+            for chain, protein_chain in zip(l_chain, l_chain_id):
+                chain['HELIX'] = select_rows(helix, (helix['init_chain_id'] == protein_chain) |
+                                                    (helix['end_chain_id'] == protein_chain))
+        if 'SHEET' in entry:
+            sheet = entry['SHEET']
+            for chain, protein_chain in zip(l_chain, l_chain_id):
+                chain['SHEET'] = select_rows(sheet, sheet['cur_chain_id'] == protein_chain)
+        return l_chain
+
+    @staticmethod
+    def parse_entry_chains(protein_name: str, l_chain_id: list, pdb_dir: str, cache: pdb_cache=None,
+                           selection: pdb_selection=None):
+        # reads and parses the file of protein_name (e.g. 12AS) once and returns the columns of each of its
+        # chains in l_chain_id (e.g. ['A', 'B']), in the same order
+        entry = pdb_parser.load_entry(protein_name, pdb_dir, cache, selection)
+        with metrics.timer('split'):
+            l_chain = pdb_parser.split_chains(entry, l_chain_id)
+        metrics.add('entries.parsed')
+        return l_chain
+
+    @staticmethod
+    def parse_chain(pdb_name: str, pdb_dir: str, cache: pdb_cache=None, selection: pdb_selection=None):
+        # returns the ATOM, HELIX and SHEET columns of a single cull list chain (e.g. 12ASA),
+        # only the record types of the selection if there is one
+        return pdb_parser.parse_entry_chains(pdb_name[:4], [pdb_name[4:]], pdb_dir, cache, selection)[0]
+
+    def parse_chains(self, l_pdb: list):
+        # generator of (pdb_name, columns) over the cull list chains l_pdb in their order, every entry is parsed
+        # once for all of its chains. chains of entries that failed to download are skipped
+        groups = dict(group_entries(l_pdb))
+        pending = dict()
+        for pdb_name in l_pdb:
+            protein_name = pdb_name[:4]
+            if protein_name in self.downloader.failed:
+                metrics.add('chains.skipped')
+                continue
+            if pdb_name not in pending:
+                l_name = [name for _, name in groups[protein_name]]
+                l_chain = self.parse_entry_chains(protein_name, [name[4:] for name in l_name], self.pdb_dir,
+                                                  self.cache, self.selection)
+                pending.update(zip(l_name, l_chain))
+            yield pdb_name, pending.pop(pdb_name)
+
+    def append_chain(self, pdb_name: str, chain: dict):
+        with metrics.timer('append'):
+            for keyword, table in [('ATOM', self.t_atom), ('HELIX', self.t_helix), ('SHEET', self.t_sheet)]:
+                if keyword in chain:
+                    table.append(chain[keyword], protein_name=pdb_name)
+        metrics.add('chains.parsed')
+
     def process_pdb_new(self, pdb_name):
-        protein_name = pdb_name[:-1]
-        protein_chain = pdb_name[-1]
-        # print('parsing {}...'.format(pdb_name))
+        self.append_chain(pdb_name, self.parse_chain(pdb_name, self.pdb_dir, self.cache, self.selection))
 
-        with open(self.pdb_dir + '/{}.pdb'.format(protein_name), 'r') as f:
-            for line in f.readlines():
-                dict_parsed_atom = self.parse_pdb_data(line, 'ATOM', pdb_name)
-                dict_parsed_helix = self.parse_pdb_data(line, 'HELIX', pdb_name)
-                dict_parsed_sheet = self.parse_pdb_data(line, 'SHEET', pdb_name)
+    def cache_args(self):
+        # arguments to open the parse cache again in a worker process
+        if self.cache is None:
+            return None
+        return self.cache.cache_dir, self.cache.parser_version, self.cache.size_limit / 1024 / 1024
 
-                if dict_parsed_atom:
-                    if dict_parsed_atom['chain_id'] == protein_chain:
-                        self.l_atom += [dict_parsed_atom]
+    def _cull_list(self, index_to_break: int=-1):
+        # cull list ids (e.g. 12ASA), only the first index_to_break of them unless it is -1
+        l_pdb = list(self.df_pdb_list['IDs'])
+        return l_pdb if index_to_break == -1 else l_pdb[:index_to_break]
 
-                elif dict_parsed_helix:
-                    if dict_parsed_helix['init_chain_id'] == protein_chain or \
-                            dict_parsed_helix['end_chain_id'] == protein_chain:
-                        self.l_helix += [dict_parsed_helix]
+    def _make_pool(self, n_workers: int):
+        # pool of parse workers that use the same pdb_dir, cache, metrics and selection as this parser
+        from multiprocessing import Pool
+        return Pool(n_workers, initializer=_init_parse_worker,
+                    initargs=(self.pdb_dir, self.cache_args(), metrics.worker_args(), self.selection))
 
-                elif dict_parsed_sheet:
-                    if dict_parsed_sheet['cur_chain_id'] == protein_chain:
-                        self.l_sheet += [dict_parsed_sheet]
+    @staticmethod
+    def chain_frames(pdb_name: str, chain: dict):
+        # turns the columns returned by parse_chain into the dataframes of a single chain
+        d_chain = {'protein_name': pdb_name}
+        for keyword, columns in chain.items():
+            table = pdb_table(keyword, [label for label in format_spacing[keyword]['label'] if label in columns])
+            table.append(columns, protein_name=pdb_name)
+            d_chain['df_' + keyword.lower()] = table.to_frame()
+        return d_chain
+
+    def iter_chains(self, index_to_break: int=-1, chunk_size: int=16, prefetch: int=2, n_workers: int=1):
+        # generator over the cull list yielding one chain at a time as
+        # {'protein_name': ..., 'df_atom': ..., 'df_helix': ..., 'df_sheet': ...}
+        # chains are downloaded and parsed in chunks of chunk_size on a background thread that stays at most
+        # prefetch chunks ahead of the consumer, so memory use doesn't depend on how many chains are read.
+        # n_workers > 1 parses every chunk on a pool of processes
+        import threading
+        import queue
+
+        l_pdb = self._cull_list(index_to_break)
+
+        # chunks are cut between entries, so all chains of an entry come from one parse of its file
+        chunks = list()
+        for group in group_entries(l_pdb):
+            if not chunks or sum(len(l_index_pdb) for _, l_index_pdb in chunks[-1]) >= chunk_size:
+                chunks.append(list())
+            chunks[-1].append(group)
+
+        q = queue.Queue(maxsize=max(prefetch, 1))
+        stop = threading.Event()
+
+        def put(item):
+            # gives up once the consumer has stopped so the thread can't block forever on a full queue
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            pool = self._make_pool(n_workers) if n_workers > 1 else None
+            try:
+                for l_group in chunks:
+                    self.downloader.download_all([protein_name for protein_name, _ in l_group])
+                    chunk = [pdb for _, l_index_pdb in l_group for _, pdb in l_index_pdb]
+                    if pool is None:
+                        l_item = list(self.parse_chains(chunk))
+                    else:
+                        chains = dict()
+                        l_group = [group for group in l_group if group[0] not in self.downloader.failed]
+                        for l_index, l_entry_chain, hits, misses, snapshot in pool.map(_parse_entry_worker, l_group):
+                            chains.update(zip(l_index, l_entry_chain))
+                            metrics.merge(snapshot)
+                            if self.cache is not None:
+                                self.cache.hits += hits
+                                self.cache.misses += misses
+                        l_item = [(pdb, chains[index]) for _, l_index_pdb in l_group for index, pdb in l_index_pdb]
+                    if not put(l_item):
+                        return
+                put(None)
+            except BaseException as e:
+                put(e)
+            finally:
+                if pool is not None:
+                    pool.terminate()
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = q.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                for pdb_name, chain in item:
+                    yield self.chain_frames(pdb_name, chain)
+        finally:
+            stop.set()
+            thread.join()
+
+    def process_all_pdb_parallel(self, index_to_break: int, n_workers: int):
+        # every worker task is one entry with all of its cull list chains, so each file is parsed once.
+        # entries are handed to the workers longest first (summed length column of the cull list) so one big
+        # entry doesn't end up alone at the tail of the run. results come back in completion order and
+        # are appended in cull list order once everything is parsed, so the output is deterministic.
+        l_pdb = self._cull_list(index_to_break)
+        lengths = self.df_pdb_list['length'].values[:len(l_pdb)]
+        l_group = [group for group in group_entries(l_pdb) if group[0] not in self.downloader.failed]
+        metrics.add('chains.skipped', len(l_pdb) - sum(len(l_index_pdb) for _, l_index_pdb in l_group))
+        entry_lengths = np.array([sum(lengths[index] for index, _ in l_index_pdb) for _, l_index_pdb in l_group])
+        schedule = [l_group[k] for k in np.argsort(-entry_lengths, kind='stable')]
+
+        l_chain = [None] * len(l_pdb)
+        n_done = 0
+        with self._make_pool(n_workers) as p:
+            for l_index, l_entry_chain, hits, misses, snapshot in p.imap_unordered(_parse_entry_worker, schedule):
+                for index, chain in zip(l_index, l_entry_chain):
+                    l_chain[index] = chain
+                    n_done += 1
+                    if n_done%500 == 0:
+                        print('completed parsing {} pdbs'.format(n_done))
+                metrics.merge(snapshot)
+                if self.cache is not None:
+                    self.cache.hits += hits
+                    self.cache.misses += misses
+        if self.cache is not None:
+            self.cache.scan()
+
+        for index, pdb_name in enumerate(l_pdb):
+            if l_chain[index] is None:
+                continue
+            self.append_chain(pdb_name, l_chain[index])
+            l_chain[index] = None
+
+    def process_all_pdb_pipelined(self, index_to_break: int, n_workers: int=1, queue_size: int=64):
+        # downloads and parsing overlap instead of running one after the other: download threads report every
+        # entry as soon as its file is on disk and it is parsed right away, here or on a pool of n_workers
+        # processes, while later entries are still downloading. at most queue_size entries are downloaded ahead
+        # of the last chain appended, so the downloads wait for the parser (backpressure) instead of running
+        # arbitrarily far ahead. chains are appended in cull list order, the output is the same as the serial loop
+        import threading
+        import queue
+        from concurrent.futures import ThreadPoolExecutor
+
+        l_pdb = self._cull_list(index_to_break)
+        l_group = group_entries(l_pdb)
+        # failures of earlier runs were already reported
+        previously_failed = set(self.downloader.failed)
+        # ('downloaded', k, bool or exception) and ('parsed', k, worker result or exception) of entry l_group[k]
+        events = queue.Queue()
+        slots = threading.Semaphore(max(queue_size, 1))
+        stop = threading.Event()
+
+        def fetch(k):
+            try:
+                events.put(('downloaded', k, self.downloader.download(l_group[k][0])))
+            except BaseException as e:
+                events.put(('downloaded', k, e))
 
+        def produce():
+            with ThreadPoolExecutor(max_workers=self.downloader.n_connections) as executor:
+                for k in range(len(l_group)):
+                    with metrics.timer('pipeline.backpressure'):
+                        while not slots.acquire(timeout=0.1):
+                            if stop.is_set():
+                                return
+                    executor.submit(fetch, k)
+
+        pool = self._make_pool(n_workers) if n_workers > 1 else None
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+
+        results = dict()
+        n_downloaded, n_parsed, next_k = 0, 0, 0
+        try:
+            while next_k < len(l_group):
+                with metrics.timer('pipeline.wait'):
+                    kind, k, value = events.get()
+                if isinstance(value, BaseException):
+                    raise value
+
+                if kind == 'downloaded':
+                    n_downloaded += 1
+                    metrics.add('pipeline.downloaded')
+                    if n_downloaded%500 == 0:
+                        print('downloaded {} of {} entries, {} downloaded ahead of the parser'.format(
+                            n_downloaded, len(l_group), n_downloaded - next_k))
+                    protein_name, l_index_pdb = l_group[k]
+                    if not value:
+                        metrics.add('chains.skipped', len(l_index_pdb))
+                        results[k] = None
+                    elif pool is None:
+                        results[k] = self.parse_entry_chains(protein_name, [pdb[4:] for _, pdb in l_index_pdb],
+                                                             self.pdb_dir, self.cache, self.selection)
+                    else:
+                        pool.apply_async(_parse_entry_worker, ((protein_name, l_index_pdb),),
+                                         callback=lambda result, k=k: events.put(('parsed', k, result)),
+                                         error_callback=lambda e, k=k: events.put(('parsed', k, e)))
+                else:
+                    _, l_chain, hits, misses, snapshot = value
+                    metrics.merge(snapshot)
+                    if self.cache is not None:
+                        self.cache.hits += hits
+                        self.cache.misses += misses
+                    results[k] = l_chain
+
+                # chains are appended in cull list order as soon as all entries before them are parsed
+                while next_k in results:
+                    l_chain = results.pop(next_k)
+                    if l_chain is not None:
+                        for (_, pdb_name), chain in zip(l_group[next_k][1], l_chain):
+                            self.append_chain(pdb_name, chain)
+                            n_parsed += 1
+                            if n_parsed%500 == 0:
+                                print('completed parsing {} pdbs'.format(n_parsed))
+                    next_k += 1
+                    slots.release()
+        finally:
+            stop.set()
+            thread.join()
+            if pool is not None:
+                pool.terminate()
+
+        failed = sorted(set(self.downloader.failed) - previously_failed)
+        if failed:
+            print('failed to download {} pdbs: {}'.format(len(failed), failed[:10]))
+        if pool is not None and self.cache is not None:
+            self.cache.scan()
 
     def process_pdb(self, pdb_name):
-        protein_name = pdb_name[:-1]
-        protein_chain = pdb_name[-1]
+        protein_name = pdb_name[:4]
+        protein_chain = pdb_name[4:]
         # print('parsing {}...'.format(pdb_name))
 
         with open(self.pdb_dir + '/{}.pdb'.format(protein_name), 'r') as f:
@@ -145,33 +864,159 @@ class pdb_parser():
                     if dict_parsed_sheet['cur_chain_id'] == protein_chain:
                         self.df_sheet = self.df_sheet.append(dict_parsed_sheet, ignore_index=True)
 
+    def check_corpus_selection(self):
+        # a corpus is made of atom records, fails before anything is downloaded or parsed if the selection
+        # leaves out atom records or columns the corpus can't fill in (see corpus_required)
+        if self.selection is None:
+            return
+        if 'ATOM' not in self.selection.records:
+            raise Exception('a corpus holds atom records, the parser is set up without them (records={})'.format(
+                self.selection.records))
+        missing = [label for label in corpus_required
+                   if label != 'protein_name' and label not in self.selection.columns['ATOM']]
+        if missing:
+            raise Exception('a corpus needs the {} columns of the atom records, the parser is set up without them'.format(
+                ', '.join(missing)))
+
+    def write_corpus(self, path: str):
+        # writes df_atom to a memory mappable corpus (see pdb_corpus.py)
+        self.check_corpus_selection()
+        writer = corpus_writer(path)
+        writer.append(self.df_atom)
+        writer.close()
+
+    def build_corpus(self, path: str, index_to_break: int=-1, chunk_size: int=16, prefetch: int=2, n_workers: int=1):
+        # same as write_corpus but streams the cull list through iter_chains, so the corpus of the full cull
+        # list can be built without holding it in memory (use with lazy=True)
+        self.check_corpus_selection()
+        writer = corpus_writer(path)
+        manifest = pdb_manifest(path + '.manifest.json')
+        manifest.chains = list()
+        manifest.entries = dict()
+        for chain in self.iter_chains(index_to_break, chunk_size, prefetch, n_workers):
+            writer.append(chain['df_atom'])
+            manifest.chains.append(chain['protein_name'])
+        writer.close()
+
+        for protein_name in dict.fromkeys(pdb_name[:4] for pdb_name in manifest.chains):
+            manifest.record_entry(protein_name, pdb_file_name(self.pdb_dir, protein_name))
+        manifest.cull_list = self.filename_list_pdb
+        manifest.parser_version = parser_version
+        manifest.save()
+
+    def sync_corpus(self, path: str, filename_list_pdb: str=None):
+        # brings a corpus written by build_corpus (or an earlier sync) up to date with a cull list, e.g. a newer
+        # pisces release, instead of rebuilding it. chains that are no longer listed are dropped, chains of entries
+        # whose file is unchanged since they were parsed are copied over from the old corpus as is, and only new
+        # chains and chains of changed entries are downloaded and parsed. a new parser_version reparses everything.
+        # filename_list_pdb replaces the cull list of the parser (the filters given to the constructor still apply)
+        self.check_corpus_selection()
+        if filename_list_pdb is not None:
+            self.filename_list_pdb = filename_list_pdb
+            self.df_pdb_list = self.filter_list_pdb(self.parse_list_pdb(filename_list_pdb), **self.list_filters)
+        l_pdb = list(self.df_pdb_list['IDs'])
+
+        manifest = pdb_manifest(path + '.manifest.json')
+        old_corpus = pdb_corpus(path) if manifest.chains and os.path.exists(path + '.json') else None
+        added, removed, kept = manifest.diff(l_pdb)
+        if manifest.parser_version is not None and manifest.parser_version != parser_version:
+            print('parser version changed from {} to {}, reparsing everything'.format(manifest.parser_version, parser_version))
+            old_corpus = None
+
+        unchanged = {protein_name for protein_name in {pdb_name[:4] for pdb_name in kept}
+                     if manifest.is_unchanged(protein_name, pdb_file_name(self.pdb_dir, protein_name))}
+        reuse = {pdb_name for pdb_name in kept
+                 if old_corpus is not None and pdb_name[:4] in unchanged and pdb_name in old_corpus.offsets}
+        to_parse = [pdb_name for pdb_name in l_pdb if pdb_name not in reuse]
+        print('sync against {}: {} added, {} removed, {} unchanged, {} to reparse'.format(
+            self.filename_list_pdb, len(added), len(removed), len(reuse), len(to_parse) - len(added)))
+
+        self.downloader.download_all([pdb_name[:4] for pdb_name in to_parse])
+        # chains to parse come out of parse_chains in cull list order, each entry parsed once
+        parsed = self.parse_chains(to_parse)
+        writer = corpus_writer(path)
+        l_chain = list()
+        recorded = set()
+        for pdb_name in l_pdb:
+            if pdb_name in reuse:
+                writer.copy_chains(old_corpus, [pdb_name])
+            elif pdb_name[:4] in self.downloader.failed:
+                continue
+            else:
+                _, chain = next(parsed)
+                writer.append(self.chain_frames(pdb_name, {'ATOM': chain['ATOM']})['df_atom'])
+                if pdb_name[:4] not in recorded:
+                    manifest.record_entry(pdb_name[:4], pdb_file_name(self.pdb_dir, pdb_name[:4]))
+                    recorded.add(pdb_name[:4])
+            l_chain.append(pdb_name)
+            if len(l_chain)%500 == 0:
+                print('synced {} chains'.format(len(l_chain)))
+        writer.close()
+
+        manifest.chains = l_chain
+        manifest.cull_list = self.filename_list_pdb
+        manifest.parser_version = parser_version
+        manifest.save()
+        return {'added': len(added), 'removed': len(removed), 'copied': len(reuse), 'parsed': len(to_parse),
+                'chains': len(l_chain)}
+
+    def export_dataset(self, path: str, partition_by: str='chunk', chains_per_partition: int=500):
+        # writes df_atom, df_helix and df_sheet to a partitioned columnar dataset (see pdb_dataset.py) as the
+        # tables atom, helix and sheet, partitioned by entry or by chunks of chains_per_partition chains
+        for table, df in [('atom', self.df_atom), ('helix', self.df_helix), ('sheet', self.df_sheet)]:
+            write_table(path, table, df, partition_by, chains_per_partition)
+
+    @staticmethod
+    def import_dataset(path: str, table: str='atom', columns: list=None, filters: dict=None):
+        # one table of a dataset written by export_dataset, e.g.
+        # pdb_parser.import_dataset('parsed', 'atom', columns=['protein_name', 'res_seq', 'x', 'y', 'z'],
+        #                           filters={'atom_name': atom_backchain, 'res_name': 'GLY'})
+        return read_table(path, table, columns, filters)
+
     def print_stats(self):
         # print(self.df_atom[:5])
         print('# atoms:{} # helices:{} # sheets: {}'.format(str(len(self.df_atom)),
                                                             str(len(self.df_helix)), 
                                                             str(len(self.df_sheet))))
+        if self.cache is not None:
+            print('cache: {}'.format(self.cache.stats()))
+        print('downloads: {}'.format(self.downloader.stats()))
+        if metrics.enabled:
+            metrics.print_report()
 
     def download_all_pdb(self, index_to_break):
-        from multiprocessing import Pool
-        p = Pool(2)
-        p.map(self.download_pdb, list(self.df_pdb_list['IDs'])[:index_to_break]) 
-        
+        l_pdb = self._cull_list(index_to_break)
+        # download_all fetches an entry once even if several of its chains are listed
+        self.downloader.download_all([pdb[:4] for pdb in l_pdb])
+
+    def download_pdb(self, protein_name):
+        # protein_name is a cull list id (e.g. 12ASA)
+        return self.downloader.download(protein_name[:4])
+
     @staticmethod
-    def download_pdb(protein_name):
-        import requests
-        pdb_dir = './pdb_data'
-        protein_name = protein_name[:-1]
-        if not(os.path.exists(pdb_dir + '/{}.pdb'.format(protein_name))):
-#             print('pdb file for {} not found. Downloading from protein data bank...'.format(protein_name))
-            
-            with open(pdb_dir + '/{}.pdb'.format(protein_name), 'wb') as f:
-                url = 'https://files.rcsb.org/view/{}.pdb'.format(protein_name)
-                r = requests.get(url)
-                f.write(r.content)
+    def filter_list_pdb(df_list_pdb: pd.DataFrame, max_resolution: float=None, max_r_factor: float=None,
+                        exptl: list=None, min_length: int=None, max_length: int=None):
+        # cull list rows passing all of the given filters (None skips a filter)
+        keep = np.ones(len(df_list_pdb), dtype=bool)
+        if max_resolution is not None:
+            keep &= (df_list_pdb['resolution'] <= max_resolution).to_numpy()
+        if max_r_factor is not None:
+            keep &= (df_list_pdb['R-factor'] <= max_r_factor).to_numpy()
+        if exptl is not None:
+            keep &= df_list_pdb['Exptl.'].isin([exptl] if isinstance(exptl, str) else exptl).to_numpy()
+        if min_length is not None:
+            keep &= (df_list_pdb['length'] >= min_length).to_numpy()
+        if max_length is not None:
+            keep &= (df_list_pdb['length'] <= max_length).to_numpy()
+        if keep.all():
+            return df_list_pdb
+        print('{} of {} chains in the cull list pass the filters'.format(int(keep.sum()), len(df_list_pdb)))
+        return df_list_pdb[keep].reset_index(drop=True)
 
     @staticmethod
     def parse_list_pdb(file_name: str):
-        with open(file_name, 'r') as file_list_pdb:
+        # the cull list may or may not be gzipped whatever its extension says
+        with open_maybe_gzip(file_name) as file_list_pdb:
             df_list_pdb = pd.read_csv(file_list_pdb, delimiter= ' ', skipinitialspace=True)
             return df_list_pdb
 
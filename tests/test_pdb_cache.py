@@ -0,0 +1,31 @@
+import os
+import threading
+import numpy as np
+from pdb_cache import pdb_cache
+from scrape_pdb import pdb_parser
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_concurrent_store(tmp_path):
+    # several caches sharing one directory store the same entry at the same time
+    file_name = os.path.join(repo_dir, 'pdb_data', '12AS.pdb')
+    entry = pdb_parser.parse_entry(file_name)
+    caches = [pdb_cache(str(tmp_path)) for _ in range(4)]
+    errors = list()
+
+    def store(cache):
+        try:
+            for _ in range(20):
+                cache.store('12AS', file_name, entry)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=store, args=(cache,)) for cache in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert sorted(os.listdir(str(tmp_path))) == ['12AS.npz']
+    loaded = pdb_cache(str(tmp_path)).load('12AS', file_name)
+    assert np.array_equal(loaded['ATOM']['x'], entry['ATOM']['x'])
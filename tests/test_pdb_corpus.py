@@ -0,0 +1,36 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from scrape_pdb import pdb_parser, atom_backchain
+from pdb_corpus import pdb_corpus
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def projected_parser(**kwargs):
+    # lazy parser over the bundled 12AS chains, the cull list and pdb_data paths are relative to the repo
+    p = pdb_parser(lazy=True, cache_dir=None, **kwargs)
+    p.df_pdb_list = pd.DataFrame({'IDs': ['12ASA', '12ASB'], 'length': [330, 330]})
+    return p
+
+def test_build_corpus_with_column_projection(tmp_path, monkeypatch):
+    monkeypatch.chdir(repo_dir)
+    path = str(tmp_path / 'corpus.bin')
+    projected_parser(atom_names=atom_backchain, columns=['x', 'y', 'z', 'res_seq', 'res_name', 'atom_name']) \
+        .build_corpus(path)
+    full = pdb_parser.parse_chain('12ASA', './pdb_data')['ATOM']
+    backbone = np.isin(full['atom_name'], atom_backchain)
+
+    corpus = pdb_corpus(path)
+    assert corpus.chains == ['12ASA', '12ASB']
+    assert np.allclose(corpus.coordinates('12ASA'), np.column_stack([full[c][backbone] for c in 'xyz']), atol=1e-3)
+    df_atom = corpus.to_frame(['12ASA'])
+    assert df_atom['atom_name'].astype(str).tolist() == full['atom_name'][backbone].tolist()
+    assert df_atom['occupancy'].isna().all()
+
+def test_corpus_without_atom_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(repo_dir)
+    with pytest.raises(Exception, match='atom records'):
+        projected_parser(records=['HELIX', 'SHEET']).build_corpus(str(tmp_path / 'corpus.bin'))
+    with pytest.raises(Exception, match='res_seq'):
+        projected_parser(columns=['x', 'y', 'z']).sync_corpus(str(tmp_path / 'corpus.bin'))
@@ -0,0 +1,92 @@
+import os
+import requests
+from pdb_download import pdb_downloader
+from pdb_io import pdb_file_name
+from scrape_pdb import pdb_parser
+
+cif_entry = b'''data_1SYN
+#
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.type_symbol
+_atom_site.auth_atom_id
+_atom_site.label_alt_id
+_atom_site.auth_comp_id
+_atom_site.auth_asym_id
+_atom_site.auth_seq_id
+_atom_site.pdbx_PDB_ins_code
+_atom_site.Cartn_x
+_atom_site.Cartn_y
+_atom_site.Cartn_z
+_atom_site.occupancy
+_atom_site.B_iso_or_equiv
+_atom_site.pdbx_formal_charge
+ATOM 1 N N . ALA A 1 ? 0.000 0.000 0.000 1.00 20.00 ?
+ATOM 2 C CA . ALA A 1 ? 1.458 0.000 0.000 1.00 20.00 ?
+ATOM 3 C C . ALA A 1 ? 2.009 1.420 0.000 1.00 20.00 ?
+#
+'''
+
+class fake_response():
+    def __init__(self, status_code: int, content: bytes=b''):
+        self.status_code = status_code
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+class fake_session():
+    # the legacy pdb file doesn't exist on the server, the mmCIF file does
+    def __init__(self):
+        self.urls = list()
+
+    def get(self, url: str, timeout: float=None):
+        self.urls.append(url)
+        return fake_response(200, cif_entry) if url.endswith('.cif') else fake_response(404)
+
+def test_invalid_legacy_file_is_replaced(tmp_path):
+    pdb_dir = str(tmp_path)
+    with open(pdb_dir + '/1SYN.pdb', 'wb') as f:
+        f.write(b'<html>503 Service Unavailable</html>')
+    downloader = pdb_downloader(pdb_dir, retries=0)
+    downloader.session = fake_session()
+
+    assert downloader.download_all(['1SYN']) == [True]
+    assert not os.path.exists(pdb_dir + '/1SYN.pdb')
+    assert pdb_file_name(pdb_dir, '1SYN') == pdb_dir + '/1SYN.cif.gz'
+    assert len(pdb_parser.parse_chain('1SYNA', pdb_dir)['ATOM']['chain_id']) == 3
+
+    # the next run finds the complete entry and doesn't download it again
+    assert downloader.download_all(['1SYN']) == [True]
+    assert len(downloader.session.urls) == 2
+    assert downloader.stats() == {'downloaded': 1, 'skipped': 1, 'failed': 0}
+
+def test_failures_reported_once(tmp_path, capsys):
+    downloader = pdb_downloader(str(tmp_path), retries=0)
+    downloader.session = fake_session()
+    # neither format of 2BAD is valid
+    downloader.session.get = lambda url, timeout=None: fake_response(404)
+
+    assert downloader.download_all(['2BAD']) == [False]
+    assert 'failed to download 1 pdbs' in capsys.readouterr().out
+    # a later chunk without new failures doesn't report the earlier ones again
+    downloader.session = fake_session()
+    assert downloader.download_all(['1SYN']) == [True]
+    assert 'failed' not in capsys.readouterr().out
+
+def test_failure_cleared_by_later_download(tmp_path):
+    downloader = pdb_downloader(str(tmp_path), retries=0)
+    downloader.session = fake_session()
+    get = downloader.session.get
+
+    def unreachable(url, timeout=None):
+        raise requests.ConnectionError('connection refused')
+    downloader.session.get = unreachable
+    assert downloader.download_all(['1SYN']) == [False]
+    assert '1SYN' in downloader.failed
+
+    downloader.session.get = get
+    assert downloader.download_all(['1SYN']) == [True]
+    assert '1SYN' not in downloader.failed
+    assert downloader.stats()['failed'] == 0
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from pdb_fragments import fragment_index, embed_angles, angle_radius
+
+def random_angles(n_residues: int, seed: int=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'protein_name': np.repeat(['1ABCA', '2DEFB'], [n_residues // 2, n_residues - n_residues // 2]),
+                         'res_seq': np.arange(n_residues), 'iCode': '', 'res_name': 'ALA',
+                         'phi': rng.uniform(-180, 180, n_residues), 'psi': rng.uniform(-180, 180, n_residues)})
+
+def brute_force(df_angles: pd.DataFrame, queries: np.ndarray, window: int):
+    # distances of every query to every window of the table
+    starts, values = fragment_index.window_starts(df_angles, window, ['phi', 'psi'])
+    embeddings = embed_angles(values[starts[:, None] + np.arange(window)]).astype(np.float64)
+    embedded = embed_angles(queries).astype(np.float64)
+    return np.linalg.norm(embedded[:, None, :] - embeddings[None, :, :], axis=2)
+
+def test_knn_matches_brute_force():
+    df_angles = random_angles(3000)
+    index = fragment_index.build(df_angles, window=7)
+    queries = np.random.default_rng(1).uniform(-180, 180, (200, 7, 2))
+    rows, distances = index.query_knn(queries, k=10)
+    expected = np.sort(brute_force(df_angles, queries, 7), axis=1)[:, :10]
+    assert all(len(np.unique(r)) == 10 for r in rows)
+    assert np.allclose(distances, expected, atol=1e-4)
+
+def test_radius_matches_brute_force():
+    df_angles = random_angles(3000, seed=2)
+    index = fragment_index.build(df_angles, window=7)
+    queries = np.random.default_rng(3).uniform(-180, 180, (20, 7, 2))
+    # a large radius covers many lists
+    radius = angle_radius(100, 14)
+    query, rows, distances = index.query_radius(queries, radius)
+    expected = brute_force(df_angles, queries, 7) <= radius
+    assert len(np.unique(np.stack([query, rows]), axis=1)[0]) == len(query)
+    assert np.array_equal(np.bincount(query, minlength=len(queries)), expected.sum(axis=1))
@@ -0,0 +1,14 @@
+import sys
+from pdb_metrics import pdb_metrics, current_rss_mb
+
+def test_rss_without_resource_module(monkeypatch):
+    # windows has no resource module, rss is then not sampled at all
+    monkeypatch.setitem(sys.modules, 'resource', None)
+    assert current_rss_mb() is None
+    metrics = pdb_metrics()
+    metrics.enable(sample_rss=True)
+    with metrics.timer('stage'):
+        pass
+    snapshot = metrics.snapshot()
+    assert snapshot['timers']['stage']['calls'] == 1
+    assert 'peak_rss_mb' not in snapshot
@@ -0,0 +1,18 @@
+import numpy as np
+from pdb_superpose import pairwise_rmsd
+
+def test_pairwise_rmsd_empty():
+    coords = np.zeros((0, 7, 3))
+    assert pairwise_rmsd(coords).shape == (0, 0)
+    i, j, rmsd = pairwise_rmsd(coords, threshold=1.0)
+    assert len(i) == len(j) == len(rmsd) == 0
+    assert i.dtype == j.dtype == np.int64 and rmsd.dtype == np.float64
+
+def test_pairwise_rmsd_threshold():
+    # the thresholded pairs are the upper triangle entries of the dense matrix within threshold
+    coords = np.random.default_rng(0).normal(size=(40, 7, 3))
+    matrix = pairwise_rmsd(coords, block_size=16)
+    i, j, rmsd = pairwise_rmsd(coords, block_size=16, threshold=np.median(matrix))
+    expected_i, expected_j = np.nonzero(np.triu(matrix <= np.median(matrix), k=1))
+    assert np.array_equal(i, expected_i) and np.array_equal(j, expected_j)
+    assert np.allclose(rmsd, matrix[i, j])
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from scrape_pdb import pdb_parser, format_spacing, format_types
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+chains = ['12ASA', '12ASB', '16VPA']
+chain_filters = {'ATOM': lambda d, c: d['chain_id'] == c,
+                 'HELIX': lambda d, c: d['init_chain_id'] == c or d['end_chain_id'] == c,
+                 'SHEET': lambda d, c: d['cur_chain_id'] == c}
+
+def line_by_line(pdb_name: str):
+    # rows of a chain as the original per line parser (process_pdb) picks them, as strings
+    rows = {keyword: list() for keyword in format_spacing}
+    with open(os.path.join(repo_dir, 'pdb_data', pdb_name[:4] + '.pdb'), 'r') as f:
+        for line in f.readlines():
+            for keyword in format_spacing:
+                parsed = pdb_parser.parse_pdb_data(None, line, keyword, pdb_name)
+                if parsed and chain_filters[keyword](parsed, pdb_name[4:]):
+                    rows[keyword].append(parsed)
+                    break
+    return rows
+
+@pytest.fixture(scope='module')
+def bulk_tables():
+    # typed tables of the bulk parser, chains of an entry split from a single parse of its file
+    p = pdb_parser(lazy=True, cache_dir=None)
+    p.pdb_dir = os.path.join(repo_dir, 'pdb_data')
+    for pdb_name, chain in p.parse_chains(chains):
+        p.append_chain(pdb_name, chain)
+    return {'ATOM': p.t_atom.to_frame(), 'HELIX': p.t_helix.to_frame(), 'SHEET': p.t_sheet.to_frame()}
+
+@pytest.mark.parametrize('keyword', list(format_spacing))
+def test_bulk_parser_matches_line_by_line(bulk_tables, keyword):
+    expected = pd.DataFrame([row for pdb_name in chains for row in line_by_line(pdb_name)[keyword]])
+    df = bulk_tables[keyword]
+    assert len(df) == len(expected) > 0
+    assert list(df.columns) == format_spacing[keyword]['label'] + ['protein_name']
+
+    for label in df.columns:
+        typ = format_types[keyword].get(label)
+        if typ == 'float':
+            assert np.allclose(df[label].to_numpy(np.float64), expected[label].astype(float), atol=1e-3), label
+        elif typ in ('int', 'Int'):
+            values = expected[label].replace('', np.nan).astype(float)
+            assert np.array_equal(df[label].astype('Float64').to_numpy(np.float64, na_value=np.nan),
+                                  values.to_numpy(), equal_nan=True), label
+        else:
+            assert df[label].astype(str).tolist() == expected[label].tolist(), label
@@ -0,0 +1,22 @@
+from benchmark import generate_synthetic_pdb, load_chains
+from utilities import pdb_utilities
+
+def write_blank_class_entry(pdb_dir: str):
+    # synthetic helical chain whose HELIX record has a blank helix class (columns 39-40)
+    file_name = generate_synthetic_pdb(pdb_dir + '/1SYN.pdb', n_chains=1, n_residues=30)
+    with open(file_name) as f:
+        l_lines = f.read().split('\n')
+    l_lines = [line[:38] + '  ' + line[40:] if line.startswith('HELIX') else line for line in l_lines]
+    with open(file_name, 'w') as f:
+        f.write('\n'.join(l_lines))
+
+def test_blank_helix_class(tmp_path):
+    write_blank_class_entry(str(tmp_path))
+    df_atom, df_helix, df_sheet = load_chains(['1SYNA'], str(tmp_path))
+    assert df_helix['helix_class'].astype(str).str.strip().tolist() == ['']
+
+    pdb_util = pdb_utilities(df_atom, df_helix, df_sheet)
+    df_ss = pdb_util.label_secondary_structure()
+    assert (df_ss['ss'] == 'H').all()
+    assert (df_ss['helix_class'] == -1).all()
+    assert len(pdb_util.build_ramachandran_helices()) == 30
@@ -1,13 +1,247 @@
 import pandas as pd
 import numpy as np
-import json
 from scrape_pdb import pdb_parser
+from pdb_corpus import pdb_corpus
+from pdb_spatial import spatial_index
+from pdb_fragments import fragment_index
+from pdb_metrics import metrics
 from matplotlib import pyplot as plt
 from matplotlib import cm
 
+# bit widths of the fields packed into one int64 key by coordinate_index
+_key_bits = {'chain': 20, 'res_seq': 16, 'iCode': 8, 'atom_name': 12, 'alt_loc': 7}
+# res_seq is 4 characters wide in pdb files (-999..9999), shifted so it packs as unsigned
+_res_seq_offset = 1000
+
+# coordinate lookup over df_atom backed by contiguous arrays.
+# every atom gets an int64 key packed from (chain, res_seq, iCode, atom_name, alt_loc) codes. the keys are
+# sorted once so lookups are a vectorized binary search (np.searchsorted) for any number of atoms at once.
+# lookups without an alt_loc return the first conformer ('' or 'A')
+class coordinate_index():
+    def __init__(self, df_atom: pd.DataFrame):
+        self.vocabulary = dict()
+        codes = dict()
+        for field in ['protein_name', 'iCode', 'atom_name', 'alt_loc']:
+            # sorted vocabularies so '' < 'A' < 'B' for alt locs
+            codes[field], self.vocabulary[field] = pd.factorize(df_atom[field].astype(str), sort=True)
+        # plain dicts are faster than Index.get_indexer for lookups of a handful of atoms
+        self.small_vocabulary = {field: {v: i for i, v in enumerate(vocabulary)}
+                                 for field, vocabulary in self.vocabulary.items()}
+
+        for field, bits in [('protein_name', 'chain'), ('iCode', 'iCode'), ('atom_name', 'atom_name'), ('alt_loc', 'alt_loc')]:
+            if len(self.vocabulary[field]) >= 2 ** _key_bits[bits]:
+                raise Exception('too many distinct values of {} for coordinate_index'.format(field))
+
+        keys = self.pack(codes['protein_name'], df_atom['res_seq'].to_numpy(), codes['iCode'],
+                         codes['atom_name'], codes['alt_loc'])
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        self.xyz = df_atom[['x', 'y', 'z']].to_numpy(dtype=np.float32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def pack(chain, res_seq, icode, atom_name, alt_loc):
+        key = np.asarray(chain, dtype=np.int64)
+        key = (key << _key_bits['res_seq']) | (np.asarray(res_seq, dtype=np.int64) + _res_seq_offset)
+        key = (key << _key_bits['iCode']) | np.asarray(icode, dtype=np.int64)
+        key = (key << _key_bits['atom_name']) | np.asarray(atom_name, dtype=np.int64)
+        key = (key << _key_bits['alt_loc']) | np.asarray(alt_loc, dtype=np.int64)
+        return key
+
+    def encode(self, field: str, values):
+        # codes of values in the vocabulary of field, -1 for values that never occur
+        values = np.asarray(values, dtype=str)
+        if len(values) <= 16:
+            vocabulary = self.small_vocabulary[field]
+            return np.array([vocabulary.get(v, -1) for v in values], dtype=np.int64)
+        return self.vocabulary[field].get_indexer(values)
+
+    def lookup(self, protein_name, res_seq, atom_name, icode=None, alt_loc=None):
+        # rows in df_atom of many atoms at once, -1 where an atom isn't there.
+        # arguments are scalars or equal length arrays, icode defaults to no insertion code
+        protein_name, res_seq, atom_name = np.broadcast_arrays(np.atleast_1d(protein_name), np.atleast_1d(res_seq),
+                                                              np.atleast_1d(atom_name))
+        n = len(protein_name)
+        icode = np.broadcast_to(np.asarray('' if icode is None else icode, dtype=str), (n,))
+
+        codes = [self.encode('protein_name', protein_name), self.encode('iCode', icode),
+                 self.encode('atom_name', atom_name)]
+        if alt_loc is None:
+            alt_codes = np.zeros(n, dtype=np.int64)
+        else:
+            alt_codes = self.encode('alt_loc', np.broadcast_to(np.asarray(alt_loc, dtype=str), (n,)))
+            codes.append(alt_codes)
+        unknown = np.any([c < 0 for c in codes], axis=0)
+
+        res_seq = res_seq.astype(np.int64)
+        key = self.pack(np.where(unknown, 0, codes[0]), np.clip(res_seq, -_res_seq_offset, 2 ** 15),
+                        np.where(unknown, 0, codes[1]), np.where(unknown, 0, codes[2]), np.where(unknown, 0, alt_codes))
+        pos = np.minimum(np.searchsorted(self.keys, key), len(self.keys) - 1)
+        found = self.keys[pos] if len(self.keys) else np.full(n, -1)
+        if alt_loc is None:
+            # any conformer matches, the search lands on the first (lowest alt_loc code) one
+            found = found >> _key_bits['alt_loc']
+            key = key >> _key_bits['alt_loc']
+        hit = (found == key) & ~unknown
+        return np.where(hit, self.order[pos] if len(self.keys) else -1, -1)
+
+    def get_coordinates(self, protein_name, res_seq, atom_name, icode=None, alt_loc=None):
+        # (n, 3) coordinates of many atoms at once, nan where an atom isn't there
+        rows = self.lookup(protein_name, res_seq, atom_name, icode, alt_loc)
+        coords = np.full((len(rows), 3), np.nan, dtype=np.float32)
+        coords[rows >= 0] = self.xyz[rows[rows >= 0]]
+        return coords
+
+# running statistics of backbone geometry measures (e.g. the columns of pdb_utilities.calculate_backbone_geometry).
+# count/sum/min/max are exact, median and quantiles come from a fixed histogram (bin_width angstroms wide over
+# [0, max_value)), so stats can be added chunk by chunk, e.g. over pdb_parser.iter_chains, and merged across
+# processes without keeping the values around
+class geometry_stats():
+    def __init__(self, measures: list=('n_ca', 'ca_c', 'c_n', 'ca_ca'), max_value: float=10.0, bin_width: float=0.001):
+        self.measures = list(measures)
+        self.max_value = max_value
+        self.bin_width = bin_width
+        n_bins = int(round(max_value / bin_width))
+        self.count = {m: 0 for m in self.measures}
+        self.sum = {m: 0.0 for m in self.measures}
+        self.sum_sq = {m: 0.0 for m in self.measures}
+        self.min = {m: np.inf for m in self.measures}
+        self.max = {m: -np.inf for m in self.measures}
+        self.histogram = {m: np.zeros(n_bins, dtype=np.int64) for m in self.measures}
+
+    def add(self, df: pd.DataFrame):
+        for m in self.measures:
+            values = df[m].to_numpy(dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if not len(values):
+                continue
+            self.count[m] += len(values)
+            self.sum[m] += values.sum()
+            self.sum_sq[m] += np.square(values).sum()
+            self.min[m] = min(self.min[m], values.min())
+            self.max[m] = max(self.max[m], values.max())
+            bins = np.clip((values / self.bin_width).astype(np.int64), 0, len(self.histogram[m]) - 1)
+            self.histogram[m] += np.bincount(bins, minlength=len(self.histogram[m]))
+        return self
+
+    def merge(self, other):
+        for m in self.measures:
+            self.count[m] += other.count[m]
+            self.sum[m] += other.sum[m]
+            self.sum_sq[m] += other.sum_sq[m]
+            self.min[m] = min(self.min[m], other.min[m])
+            self.max[m] = max(self.max[m], other.max[m])
+            self.histogram[m] += other.histogram[m]
+        return self
+
+    def quantile(self, measure: str, q: float):
+        # value at quantile q, resolved to the middle of a histogram bin
+        cumulative = np.cumsum(self.histogram[measure])
+        if not cumulative[-1]:
+            return np.nan
+        i = np.searchsorted(cumulative, q * cumulative[-1])
+        return (min(i, len(cumulative) - 1) + 0.5) * self.bin_width
+
+    def summary(self, quantiles: list=(0.01, 0.05, 0.25, 0.75, 0.95, 0.99)):
+        l_row = list()
+        for m in self.measures:
+            n = self.count[m]
+            mean = self.sum[m] / n if n else np.nan
+            row = {'measure': m, 'count': n,
+                   'min': self.min[m] if n else np.nan, 'max': self.max[m] if n else np.nan,
+                   'mean': mean, 'std': np.sqrt(max(self.sum_sq[m] / n - mean ** 2, 0)) if n else np.nan,
+                   'median': self.quantile(m, 0.5)}
+            for q in quantiles:
+                row['q{:g}'.format(q * 100)] = self.quantile(m, q)
+            l_row.append(row)
+        return pd.DataFrame(l_row).set_index('measure')
+
+# phi/psi counts on a fixed grid of bin_size degrees, one 2D histogram per (res_name, ss) key.
+# ss is 'H<helix_class>' for helix residues (e.g. 'H1' for right-handed alpha), 'E' for strands and '-' for the
+# rest, as labelled by pdb_utilities.assign_secondary_structure. histograms of chunks or worker processes add up
+# with merge, and save/load keep them in one npz file, so plots never have to touch the residues again
+class ramachandran_histogram():
+    def __init__(self, bin_size: float=2.0):
+        self.bin_size = bin_size
+        self.n_bins = int(round(360 / bin_size))
+        self.counts = dict()
+
+    @staticmethod
+    def ss_labels(df: pd.DataFrame):
+        if 'ss' not in df:
+            return np.full(len(df), '-', dtype=object)
+        ss = df['ss'].astype(str).to_numpy().astype(object)
+        helix = ss == 'H'
+        ss[helix] = 'H' + df['helix_class'].astype(str).to_numpy()[helix].astype(object)
+        return ss
+
+    def add(self, df: pd.DataFrame):
+        # df has res_name, phi and psi columns and optionally the ss/helix_class labels (build_ramachandran_ss).
+        # residues without both angles are left out
+        df = df[df['phi'].notna().to_numpy() & df['psi'].notna().to_numpy()]
+        if not len(df):
+            return self
+        keys, uniques = pd.factorize(pd.Series(df['res_name'].astype(str).to_numpy().astype(object) + '/' +
+                                               self.ss_labels(df)))
+        phi = np.clip(((df['phi'].to_numpy() + 180) / self.bin_size).astype(np.int64), 0, self.n_bins - 1)
+        psi = np.clip(((df['psi'].to_numpy() + 180) / self.bin_size).astype(np.int64), 0, self.n_bins - 1)
+
+        # one bincount over all keys at once, rows are phi and columns psi
+        size = self.n_bins * self.n_bins
+        counts = np.bincount((keys * self.n_bins + phi) * self.n_bins + psi, minlength=len(uniques) * size)
+        for k, key in enumerate(uniques):
+            key = tuple(key.split('/'))
+            histogram = counts[k * size:(k + 1) * size].reshape(self.n_bins, self.n_bins)
+            if key in self.counts:
+                self.counts[key] += histogram
+            else:
+                self.counts[key] = histogram.copy()
+        return self
+
+    def merge(self, other):
+        if other.bin_size != self.bin_size:
+            raise ValueError('can not merge histograms of {} and {} degree bins'.format(self.bin_size, other.bin_size))
+        for key, histogram in other.counts.items():
+            if key in self.counts:
+                self.counts[key] = self.counts[key] + histogram
+            else:
+                self.counts[key] = histogram.copy()
+        return self
+
+    def total(self, res_name: str=None, ss: str=None):
+        # sum of the histograms of res_name (all if None) and ss ('H' matches every helix class)
+        histogram = np.zeros((self.n_bins, self.n_bins), dtype=np.int64)
+        for (key_res_name, key_ss), counts in self.counts.items():
+            if res_name is not None and key_res_name != res_name:
+                continue
+            if ss is not None and key_ss != ss and not (ss == 'H' and key_ss.startswith('H')):
+                continue
+            histogram += counts
+        return histogram
+
+    def save(self, file_name: str):
+        keys = sorted(self.counts)
+        np.savez_compressed(file_name, bin_size=self.bin_size,
+                            res_name=np.array([k[0] for k in keys], dtype=str),
+                            ss=np.array([k[1] for k in keys], dtype=str),
+                            counts=np.array([self.counts[k] for k in keys], dtype=np.int64).reshape(-1, self.n_bins, self.n_bins))
+
+    @staticmethod
+    def load(file_name: str):
+        with np.load(file_name) as f:
+            histogram = ramachandran_histogram(float(f['bin_size']))
+            for res_name, ss, counts in zip(f['res_name'], f['ss'], f['counts']):
+                histogram.counts[(str(res_name), str(ss))] = counts
+        return histogram
+
 # utilities to analyze the pdb data parsed out by pdb_parser class in scrape_pdb.py
 class pdb_utilities:
     def __init__(self, df_atom, df_helix, df_sheet):
+        # df_atom can also be a pdb_corpus written by pdb_parser.write_corpus/build_corpus
+        if isinstance(df_atom, pdb_corpus):
+            df_atom = df_atom.to_frame()
         self.df_atom = df_atom
         self.df_helix = df_helix
         self.df_sheet = df_sheet
@@ -25,9 +259,17 @@ class pdb_utilities:
             '9': '2-7 ribbon/hex',
             '10': 'polyproline'
         }
-        self.df_atom['new_index'] = self.df_atom.apply(lambda x: x['protein_name']+x['res_seq']+x['atom_name'], axis=1)
-        self.df_atom = self.df_atom.set_index('new_index')
-        self.dict_coordinates = self.build_coordinates_lookup()
+        with metrics.timer('index_build'):
+            self.coordinates = coordinate_index(self.df_atom)
+        # per residue phi/psi/omega of every chain, built on first use by build_backbone_angles
+        self.df_angles = None
+        # per residue HELIX/SHEET labels, built on first use by assign_secondary_structure
+        self.df_ss = None
+        # spatial_index over all atoms grouped by chain, built on first use by find_neighbors
+        self.spatial = None
+        # per residue dssp labels and backbone hydrogen bonds, built on first use by build_dssp
+        self.df_dssp = None
+        self.df_hbonds = None
 
     def find_coordinates_atom(self, protein_name: str, atom_name: str):
         # l_atom_name = atom_name.split('.')
@@ -40,8 +282,14 @@ class pdb_utilities:
         # return {'x': float(found_atom['x']), 
         #         'y': float(found_atom['y']), 
         #         'z': float(found_atom['z'])}
-        c = self.dict_coordinates[protein_name + atom_name.replace('.', '')]
-        return {'x': float(c['x']), 'y': float(c['y']), 'z': float(c['z'])}
+        # atom_name is <res_seq>[iCode].<atom name>, e.g. 327.CA or 52A.N
+        res, atom = atom_name.split('.')
+        icode = res[-1] if res[-1].isalpha() else ''
+        row = self.coordinates.lookup(protein_name, int(res[:-1] if icode else res), atom, icode)[0]
+        if row < 0:
+            raise KeyError(protein_name + atom_name)
+        x, y, z = self.coordinates.xyz[row]
+        return {'x': float(x), 'y': float(y), 'z': float(z)}
 
     @staticmethod
     def listify_coordinates(d: dict):
@@ -96,6 +344,228 @@ class pdb_utilities:
 
         return round(np.degrees(np.arctan2(y, x)), 3)        
 
+    @staticmethod
+    def calculate_dihedrals(p0: np.ndarray, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray):
+        # calculate_dihedral for many quadruples at once, p0..p3 are (n, 3) arrays.
+        # rows with a missing (nan) coordinate come out as nan
+        v1 = p0 - p1
+        v2 = p2 - p1
+        v3 = p3 - p2
+
+        v1xv2 = np.cross(v1, v2)
+        v2xv3 = np.cross(v3, v2)
+
+        v1xv2_x_v2xv3 = np.cross(v1xv2, v2xv3)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            y = np.einsum('ij,ij->i', v1xv2_x_v2xv3, v2) / np.linalg.norm(v2, axis=1)
+        x = np.einsum('ij,ij->i', v1xv2, v2xv3)
+
+        return np.round(np.degrees(np.arctan2(y, x)), 3)
+
+    @staticmethod
+    def residue_numbers(df_atom: pd.DataFrame):
+        # position of the residue of every atom, residues are told apart by chain, res_seq and iCode.
+        # returns (residue, first atom of every residue as a mask)
+        protein = pd.factorize(df_atom['protein_name'])[0]
+        res_seq = df_atom['res_seq'].to_numpy().astype(np.int64)
+        icode = pd.factorize(df_atom['iCode'])[0]
+
+        new_residue = np.ones(len(df_atom), dtype=bool)
+        new_residue[1:] = (protein[1:] != protein[:-1]) | (res_seq[1:] != res_seq[:-1]) | (icode[1:] != icode[:-1])
+        return np.cumsum(new_residue) - 1, new_residue
+
+    @staticmethod
+    def backbone_coordinates(df_atom: pd.DataFrame, atoms: tuple=('N', 'CA', 'C')):
+        # one row per residue (in file order) with the coordinates of the given atoms of every residue as (n, 3)
+        # arrays, nan where an atom is missing. only the first alt loc of an atom is used
+        residue, new_residue = pdb_utilities.residue_numbers(df_atom)
+        df_residue = df_atom.loc[new_residue, ['protein_name', 'res_seq', 'iCode', 'res_name']].reset_index(drop=True)
+        n_residues = len(df_residue)
+
+        atom_name = df_atom['atom_name'].astype(str).to_numpy()
+        xyz = df_atom[['x', 'y', 'z']].to_numpy(dtype=np.float64)
+        coords = dict()
+        for name in atoms:
+            rows = np.flatnonzero(atom_name == name)
+            # keep the first alt loc of each residue
+            rows = rows[np.unique(residue[rows], return_index=True)[1]]
+            coords[name] = np.full((n_residues, 3), np.nan)
+            coords[name][residue[rows]] = xyz[rows]
+
+        return df_residue, pd.factorize(df_residue['protein_name'])[0], coords
+
+    def build_backbone_angles(self, df_atom: pd.DataFrame=None, max_peptide_bond: float=2.0):
+        # phi, psi and omega of every residue of every chain in df_atom in one batched pass.
+        # phi = C(i-1)-N-CA-C, psi = N-CA-C-N(i+1), omega = CA(i-1)-C(i-1)-N-CA.
+        # consecutive residues only count as bonded if they are in the same chain and C(i-1)-N(i) is shorter
+        # than max_peptide_bond angstroms, angles across chain breaks or missing atoms are nan
+        with metrics.timer('angles'):
+            df_residue = self.calculate_backbone_angles(self.df_atom if df_atom is None else df_atom, max_peptide_bond)
+        metrics.add('residues', len(df_residue))
+        if df_atom is None:
+            self.df_angles = df_residue
+        return df_residue
+
+    def calculate_backbone_angles(self, df_atom: pd.DataFrame, max_peptide_bond: float):
+        df_residue, chain, coords = self.backbone_coordinates(df_atom)
+        n, ca, c = coords['N'], coords['CA'], coords['C']
+
+        # bonded[i] tells whether residue i is linked to residue i+1
+        with np.errstate(invalid='ignore'):
+            bonded = (chain[:-1] == chain[1:]) & (np.linalg.norm(n[1:] - c[:-1], axis=1) < max_peptide_bond)
+
+        phi = np.full(len(df_residue), np.nan)
+        psi = np.full(len(df_residue), np.nan)
+        omega = np.full(len(df_residue), np.nan)
+        phi[1:] = np.where(bonded, self.calculate_dihedrals(c[:-1], n[1:], ca[1:], c[1:]), np.nan)
+        psi[:-1] = np.where(bonded, self.calculate_dihedrals(n[:-1], ca[:-1], c[:-1], n[1:]), np.nan)
+        omega[1:] = np.where(bonded, self.calculate_dihedrals(ca[:-1], c[:-1], n[1:], ca[1:]), np.nan)
+
+        df_residue['phi'] = phi
+        df_residue['psi'] = psi
+        df_residue['omega'] = omega
+        return df_residue
+
+    @staticmethod
+    def calculate_backbone_geometry(df_atom: pd.DataFrame):
+        # backbone bond lengths of every residue of every chain in one pass: n_ca and ca_c within the residue,
+        # c_n (peptide bond) and ca_ca to the next residue. the last two are nan at chain ends and at gaps in
+        # the residue numbering (missing residues), consecutive insertion codes count as neighbours
+        df_residue, chain, coords = pdb_utilities.backbone_coordinates(df_atom)
+        n, ca, c = coords['N'], coords['CA'], coords['C']
+        res_seq = df_residue['res_seq'].to_numpy().astype(np.int64)
+        neighbour = (chain[:-1] == chain[1:]) & (np.diff(res_seq) >= 0) & (np.diff(res_seq) <= 1)
+
+        df_residue['n_ca'] = np.linalg.norm(ca - n, axis=1)
+        df_residue['ca_c'] = np.linalg.norm(c - ca, axis=1)
+        c_n = np.full(len(df_residue), np.nan)
+        ca_ca = np.full(len(df_residue), np.nan)
+        c_n[:-1] = np.where(neighbour, np.linalg.norm(n[1:] - c[:-1], axis=1), np.nan)
+        ca_ca[:-1] = np.where(neighbour, np.linalg.norm(ca[1:] - ca[:-1], axis=1), np.nan)
+        df_residue['c_n'] = c_n
+        df_residue['ca_ca'] = ca_ca
+        return df_residue
+
+    def build_backbone_geometry_stats(self):
+        # summary (min/max/mean/median/quantiles) of the backbone bond lengths of all chains in df_atom.
+        # to go over the whole cull list, add calculate_backbone_geometry of every chain from
+        # pdb_parser.iter_chains to one geometry_stats instead
+        return geometry_stats().add(self.calculate_backbone_geometry(self.df_atom)).summary()
+
+    def get_spatial_index(self):
+        if self.spatial is None:
+            self.spatial = spatial_index(self.df_atom[['x', 'y', 'z']].to_numpy(dtype=np.float64),
+                                         pd.factorize(self.df_atom['protein_name'])[0])
+        return self.spatial
+
+    def find_neighbors(self, protein_name, res_seq, atom_name, radius: float=8.0, icode=None):
+        # atoms of the same chain within radius angstroms of many atoms at once (same arguments as
+        # coordinate_index.lookup). query is the position of the atom in the arguments, the atom itself is included
+        rows = self.coordinates.lookup(protein_name, res_seq, atom_name, icode)
+        found = np.flatnonzero(rows >= 0)
+        index = self.get_spatial_index()
+        chain = pd.factorize(self.df_atom['protein_name'])[0]
+        query, row, distance = index.query_radius(index.xyz[rows[found]], radius, chain[rows[found]])
+
+        df_neighbors = self.df_atom.iloc[row][['protein_name', 'res_seq', 'iCode', 'res_name', 'atom_name', 'alt_loc']]
+        df_neighbors.insert(0, 'query', found[query])
+        df_neighbors['distance'] = distance
+        return df_neighbors.reset_index(drop=True)
+
+    def build_contact_map(self, cutoff: float=8.0, atoms: str='CA', min_separation: int=1, df_atom: pd.DataFrame=None):
+        # sparse residue contact map of every chain: one row per pair of residues of the same chain closer than
+        # cutoff angstroms, with i < j positions in the residue table and at least min_separation apart.
+        # atoms='CA' measures CA-CA distances, atoms='heavy' the closest pair of heavy atoms (first alt loc)
+        df_atom = self.df_atom if df_atom is None else df_atom
+        residue, new_residue = self.residue_numbers(df_atom)
+        df_residue = df_atom.loc[new_residue, ['protein_name', 'res_seq', 'iCode', 'res_name']].reset_index(drop=True)
+
+        atom_name = df_atom['atom_name'].astype(str).to_numpy()
+        if atoms == 'CA':
+            keep = atom_name == 'CA'
+        elif atoms == 'heavy':
+            keep = ~df_atom['element'].astype(str).isin(['H', 'D']).to_numpy()
+        else:
+            raise ValueError('atoms has to be CA or heavy, not {}'.format(atoms))
+        rows = np.flatnonzero(keep)
+        # first alt loc of every atom of a residue
+        atom_code = pd.factorize(atom_name[rows])[0]
+        rows = rows[np.unique(residue[rows] * (atom_code.max() + 1 if len(rows) else 1) + atom_code, return_index=True)[1]]
+
+        chain = pd.factorize(df_residue['protein_name'])[0]
+        index = spatial_index(df_atom[['x', 'y', 'z']].to_numpy(dtype=np.float64)[rows], chain[residue[rows]],
+                              cell_size=max(cutoff, 1.0))
+        i, j, distance = index.pairs(cutoff)
+        i, j = residue[rows[i]], residue[rows[j]]
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        df_contacts = pd.DataFrame({'i': i, 'j': j, 'distance': distance})
+        df_contacts = df_contacts[df_contacts['j'] - df_contacts['i'] >= min_separation]
+        # closest pair of atoms of every pair of residues
+        df_contacts = df_contacts.groupby(['i', 'j'], sort=True, as_index=False)['distance'].min()
+
+        i, j = df_contacts['i'].to_numpy(), df_contacts['j'].to_numpy()
+        return pd.DataFrame({'protein_name': df_residue['protein_name'].to_numpy()[i],
+                             'i': i, 'j': j,
+                             'res_seq_i': df_residue['res_seq'].to_numpy()[i],
+                             'iCode_i': df_residue['iCode'].to_numpy()[i],
+                             'res_name_i': df_residue['res_name'].to_numpy()[i],
+                             'res_seq_j': df_residue['res_seq'].to_numpy()[j],
+                             'iCode_j': df_residue['iCode'].to_numpy()[j],
+                             'res_name_j': df_residue['res_name'].to_numpy()[j],
+                             'distance': df_contacts['distance'].to_numpy()})
+
+    def check_sheet_registration(self, max_distance: float=3.5, search_radius: float=5.0):
+        # distance between the two atoms of every registration (cur_atom of cur_res_seq, usually N, and
+        # prev_atom of prev_res_seq, usually O) recorded in df_sheet, and the closest atom named prev_atom in
+        # the previous strand's chain within search_radius of cur_atom (leaving out the residues next to
+        # cur_res_seq). registered tells if the recorded pair is closer than max_distance
+        df_sheet = self.df_sheet[self.df_sheet['cur_res_seq'].notna().to_numpy()]
+        entry = df_sheet['protein_name'].astype(str).str[:4]
+        cur_chain = (entry + df_sheet['cur_chain_id'].astype(str)).to_numpy()
+        prev_chain = (entry + df_sheet['prev_chain_id'].astype(str)).to_numpy()
+        cur_res_seq = df_sheet['cur_res_seq'].to_numpy().astype(np.int64)
+        prev_atom = df_sheet['prev_atom'].astype(str).to_numpy()
+
+        cur_xyz = self.coordinates.get_coordinates(cur_chain, cur_res_seq, df_sheet['cur_atom'].astype(str).to_numpy(),
+                                                   df_sheet['cur_iCode'].astype(str).to_numpy()).astype(np.float64)
+        prev_xyz = self.coordinates.get_coordinates(prev_chain, df_sheet['prev_res_seq'].to_numpy().astype(np.int64),
+                                                    prev_atom, df_sheet['rev_iCode'].astype(str).to_numpy()).astype(np.float64)
+        distance = np.linalg.norm(cur_xyz - prev_xyz, axis=1)
+
+        # candidate partners: atoms of any name used as prev_atom, grouped by (chain, atom name)
+        rows = np.flatnonzero(self.df_atom['atom_name'].astype(str).isin(np.unique(prev_atom)).to_numpy())
+        groups, group_names = pd.factorize(self.df_atom['protein_name'].astype(str).to_numpy()[rows] + '.' +
+                                           self.df_atom['atom_name'].astype(str).to_numpy()[rows])
+        query_group = pd.Index(group_names).get_indexer(prev_chain + '.' + prev_atom)
+        index = spatial_index(self.df_atom[['x', 'y', 'z']].to_numpy(dtype=np.float64)[rows], groups,
+                              cell_size=max(search_radius, 1.0))
+        query, row, nearest_distance = index.query_radius(cur_xyz, search_radius, query_group)
+
+        res_seq = self.df_atom['res_seq'].to_numpy().astype(np.int64)[rows]
+        # leave out the chain neighbours of the cur residue, O(i-1) always sits next to N(i)
+        local = (cur_chain[query] == prev_chain[query]) & (np.abs(res_seq[row] - cur_res_seq[query]) <= 1)
+        query, row, nearest_distance = query[~local], row[~local], nearest_distance[~local]
+        # query_radius sorts by distance, the first hit of every query is the closest
+        first = np.unique(query, return_index=True)[1]
+        nearest_res_seq = np.full(len(df_sheet), np.nan)
+        nearest = np.full(len(df_sheet), np.nan)
+        nearest_res_seq[query[first]] = res_seq[row[first]]
+        nearest[query[first]] = nearest_distance[first]
+
+        df_registration = df_sheet[['protein_name', 'sheet_id', 'strand', 'cur_atom', 'cur_res_name', 'cur_res_seq',
+                                    'prev_atom', 'prev_res_name', 'prev_res_seq']].reset_index(drop=True)
+        df_registration['distance'] = distance
+        df_registration['registered'] = distance <= max_distance
+        df_registration['nearest_res_seq'] = pd.array(nearest_res_seq, dtype='Int32')
+        df_registration['nearest_distance'] = nearest
+        return df_registration
+
+    def get_backbone_angles(self):
+        if self.df_angles is None:
+            self.build_backbone_angles()
+        return self.df_angles
+
     def plot_ramachandran(self, df: pd.DataFrame, alpha: float, s: float, colorcode_by: str=''):
         plt.grid()
         plt.xlabel('phi')
@@ -111,50 +581,376 @@ class pdb_utilities:
             plt.scatter(df['phi'], df['psi'], alpha=alpha, s=s)
 
         
+    def build_ramachandran_histogram(self, bin_size: float=2.0):
+        # binned phi/psi of every residue keyed by res_name and secondary structure
+        return ramachandran_histogram(bin_size).add(self.build_ramachandran_ss())
+
+    @staticmethod
+    def plot_ramachandran_density(histogram: ramachandran_histogram, res_name: str=None, ss: str=None,
+                                  kind: str='heatmap', log: bool=True):
+        # renders a ramachandran_histogram (selected like ramachandran_histogram.total) as a heatmap or contour
+        # plot, the cost depends on the number of bins and not on the number of residues
+        counts = histogram.total(res_name, ss).astype(np.float64)
+        if log:
+            counts = np.log1p(counts)
+        # transposed so phi runs along x and psi along y
+        counts = counts.T
+        plt.xlabel('phi')
+        plt.ylabel('psi')
+        if kind == 'heatmap':
+            plt.imshow(counts, origin='lower', extent=(-180, 180, -180, 180), aspect='equal', cmap='viridis')
+        elif kind == 'contour':
+            centers = np.arange(histogram.n_bins) * histogram.bin_size - 180 + histogram.bin_size / 2
+            plt.contourf(centers, centers, counts, levels=10, cmap='viridis')
+        else:
+            raise ValueError('kind has to be heatmap or contour, not {}'.format(kind))
+        plt.colorbar(label='log(1 + count)' if log else 'count')
+        plt.title(' '.join(str(v) for v in [res_name, ss] if v is not None))
+
+    def build_fragment_index(self, window: int=7, angles: tuple=('phi', 'psi'), path: str=None):
+        # fragment_index over every window of window residues of the backbone angles of every chain (see
+        # pdb_fragments.py), saved to path if given. load it again with fragment_index.load(path)
+        with metrics.timer('fragment_index'):
+            index = fragment_index.build(self.get_backbone_angles(), window, angles)
+        metrics.add('fragments', len(index))
+        if path is not None:
+            index.save(path)
+        return index
+
     def build_ramachandran_aa(self, res_name):
-        df_aa = self.df_atom[self.df_atom['res_name'] == res_name][['protein_name', 'res_seq']].drop_duplicates(keep='first')
-        df_aa['psi'] = df_aa.apply(lambda x: self.calculate_angle(x['protein_name'], x['res_seq'], 'psi'), axis=1)
-        df_aa['phi'] = df_aa.apply(lambda x: self.calculate_angle(x['protein_name'], x['res_seq'], 'phi'), axis=1)
+        df_angles = self.get_backbone_angles()
+        df_aa = df_angles.loc[df_angles['res_name'] == res_name, ['protein_name', 'res_seq', 'psi', 'phi']]
         # self.plot_ramachandran(df_aa)
-        return df_aa
+        return df_aa.reset_index(drop=True)
 
-    def build_ramachandran_helices(self):
-        df_helices_ramanchandran = pd.DataFrame()
-        l_dict_ramanchandra = list()
+    @staticmethod
+    def locate_residues(df_residue: pd.DataFrame, protein_name, res_seq, icode):
+        # positions in df_residue of the residues (protein_name, res_seq, iCode), -1 if not there
+        df_key = pd.DataFrame({'protein_name': np.asarray(protein_name, dtype=str),
+                               'res_seq': np.asarray(res_seq, dtype=np.int64),
+                               'iCode': np.asarray(icode, dtype=str)})
+        df_pos = pd.DataFrame({'protein_name': df_residue['protein_name'].astype(str).to_numpy(),
+                               'res_seq': df_residue['res_seq'].to_numpy().astype(np.int64),
+                               'iCode': df_residue['iCode'].astype(str).to_numpy(),
+                               'pos': np.arange(len(df_residue))})
+        df_pos = df_pos.drop_duplicates(['protein_name', 'res_seq', 'iCode'], keep='first')
+        pos = df_key.merge(df_pos, how='left', on=['protein_name', 'res_seq', 'iCode'])['pos']
+        return pos.fillna(-1).to_numpy().astype(np.int64)
 
-        for helix in self.df_helix[['protein_name', 'helix_class', 'init_seq_num', 'end_seq_num', 'init_chain_id', 'end_chain_id']].values:
-            if helix[4] != helix[5]:
-                print('end_chain_id and init_chain_id not matching!!!!!', helix[4], helix[5])
-            else:
-                for i in range(int(helix[2]), int(helix[3])+1):
-                    dict_helix = {
-                        'helix_type': self.type_helix[helix[1]],
-                        'helix_class': helix[1],
-                        'protein_name': helix[0],
-                        'aa_seq_num': str(i),
-                        'psi': self.calculate_angle(helix[0], str(i), 'psi'),
-                        'phi': self.calculate_angle(helix[0], str(i), 'phi')
-                    }
-                    # print(dict_helix)
-                    l_dict_ramanchandra += [dict_helix]
-            
-        df_helices_ramanchandran = pd.read_json(json.dumps(l_dict_ramanchandra))
-        return df_helices_ramanchandran
-    
-    def build_coordinates_lookup(self):
-        dict_coordinates = dict()
-
-        import time
-        print('building coordinates...')
-        now = time.time()
-
-        for index, row in self.df_atom.iterrows():
-            dict_coordinates[index] = {'x': row['x'], 'y': row['y'], 'z': row['z']}
-        
-        print('build_coordinates_lookup took {}s.....'.format(time.time()-now))
+    @staticmethod
+    def expand_intervals(start: np.ndarray, end: np.ndarray):
+        # (positions, interval) of every position covered by the intervals [start, end]
+        lengths = end - start + 1
+        interval = np.repeat(np.arange(len(start)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return start[interval] + offsets, interval
+
+    def record_bounds(self, df_residue: pd.DataFrame, df_records: pd.DataFrame):
+        # (start, end, records) positions in df_residue of the first and last residue of HELIX or SHEET records.
+        # records spanning two chains, not in the chain of their protein_name or with ends that have no
+        # coordinates are dropped
+        chain = df_records['protein_name'].astype(str).str[4:]
+        same_chain = (df_records['init_chain_id'].astype(str) == chain) & (df_records['end_chain_id'].astype(str) == chain)
+        if (~same_chain).any():
+            print('end_chain_id and init_chain_id not matching!!!!! skipping {} records'.format(int((~same_chain).sum())))
+        df_records = df_records[same_chain.to_numpy()]
+
+        start = self.locate_residues(df_residue, df_records['protein_name'], df_records['init_seq_num'], df_records['init_iCode'])
+        end = self.locate_residues(df_residue, df_records['protein_name'], df_records['end_seq_num'], df_records['end_iCode'])
+        valid = (start >= 0) & (end >= start)
+        return start[valid], end[valid], df_records[valid]
+
+    def map_intervals(self, df_residue: pd.DataFrame, df_records: pd.DataFrame):
+        # positions in df_residue covered by HELIX or SHEET records, with the record of every position
+        start, end, df_records = self.record_bounds(df_residue, df_records)
+        positions, interval = self.expand_intervals(start, end)
+        return positions, df_records.iloc[interval]
+
+    def assign_secondary_structure(self):
+        with metrics.timer('secondary_structure'):
+            return self.label_secondary_structure()
+
+    def label_secondary_structure(self):
+        # labels every residue with the HELIX or SHEET record covering it, in one vectorized interval join.
+        # ss is 'H' for helices, 'E' for strands and '-' otherwise. helix_class/helix_type come from the HELIX
+        # record and sheet_id/strand/sense from the SHEET record
+        df_ss = self.get_backbone_angles()[['protein_name', 'res_seq', 'iCode', 'res_name']].copy()
+        n = len(df_ss)
+
+        ss = np.full(n, '-', dtype=object)
+        helix_class = np.full(n, -1, dtype=np.int64)
+        sheet_id = np.full(n, '', dtype=object)
+        strand = np.full(n, -1, dtype=np.int64)
+        sense = np.full(n, 0, dtype=np.int64)
 
-        return dict_coordinates
+        positions, df_helix = self.map_intervals(df_ss, self.df_helix)
+        ss[positions] = 'H'
+        # blank (legacy) or '?' (mmCIF) helix classes are unknown, like residues outside any helix
+        helix_class[positions] = pd.to_numeric(df_helix['helix_class'], errors='coerce').fillna(-1) \
+            .astype(np.int64).to_numpy()
+
+        positions, df_sheet = self.map_intervals(df_ss, self.df_sheet)
+        ss[positions] = 'E'
+        sheet_id[positions] = df_sheet['sheet_id'].astype(str).to_numpy()
+        strand[positions] = df_sheet['strand'].to_numpy()
+        sense[positions] = df_sheet['sense'].to_numpy()
+
+        df_ss['ss'] = ss
+        df_ss['helix_class'] = helix_class
+        df_ss['helix_type'] = pd.Series(helix_class.astype(str)).map(self.type_helix).to_numpy()
+        df_ss['sheet_id'] = sheet_id
+        df_ss['strand'] = strand
+        df_ss['sense'] = sense
+        self.df_ss = df_ss
+        return df_ss
+
+    def get_secondary_structure(self):
+        if self.df_ss is None:
+            self.assign_secondary_structure()
+        return self.df_ss
+
+    @staticmethod
+    def calculate_hbond_energies(chain: np.ndarray, coords: dict, bonded: np.ndarray, donor: np.ndarray,
+                                 cutoff: float=9.0, max_energy: float=-0.5, block_size: int=1 << 16):
+        # electrostatic energy (kcal/mol, as in DSSP) of the backbone hydrogen bonds C=O(acceptor)..H-N(donor)
+        # between residues of the same chain whose CA atoms are closer than cutoff. candidate pairs come from a
+        # spatial_index over the CA atoms, block_size residues at a time, instead of all pairs of residues.
+        # H sits 1 angstrom from N opposite the C=O of the previous residue, so residues without a bonded
+        # predecessor (bonded[i-1] False) and residues with donor False (prolines) donate nothing.
+        # returns (acceptor, donor, energy) of the bonds below max_energy, only the two strongest of every donor
+        n, ca, c, o = coords['N'], coords['CA'], coords['C'], coords['O']
+        h = np.full_like(n, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            co = c[:-1] - o[:-1]
+            h[1:] = np.where(bonded[:, None], n[1:] + co / np.linalg.norm(co, axis=1)[:, None], np.nan)
+        h[~donor] = np.nan
+
+        index = spatial_index(ca, chain, cell_size=cutoff)
+        l_acceptor, l_donor, l_energy = list(), list(), list()
+        for start in range(0, len(ca), block_size):
+            query, acceptor, _ = index.query_radius(ca[start:start + block_size], cutoff,
+                                                    chain[start:start + block_size], sort=False)
+            d = query + start
+            # no bond of a residue to itself or from the C=O of the previous residue
+            keep = (acceptor != d) & (acceptor != d - 1)
+            d, acceptor = d[keep], acceptor[keep]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                r_on = np.linalg.norm(o[acceptor] - n[d], axis=1)
+                r_ch = np.linalg.norm(c[acceptor] - h[d], axis=1)
+                r_oh = np.linalg.norm(o[acceptor] - h[d], axis=1)
+                r_cn = np.linalg.norm(c[acceptor] - n[d], axis=1)
+                energy = 27.888 * (1 / r_on + 1 / r_ch - 1 / r_oh - 1 / r_cn)
+                # atoms on top of each other count as the strongest possible bond
+                too_close = np.minimum.reduce([r_on, r_ch, r_oh, r_cn]) < 0.5
+                energy = np.where(too_close, -9.9, np.maximum(energy, -9.9))
+                keep = energy < max_energy
+            l_acceptor.append(acceptor[keep])
+            l_donor.append(d[keep])
+            l_energy.append(energy[keep])
+
+        acceptor = np.concatenate(l_acceptor) if l_acceptor else np.zeros(0, dtype=np.int64)
+        d = np.concatenate(l_donor) if l_donor else np.zeros(0, dtype=np.int64)
+        energy = np.concatenate(l_energy) if l_energy else np.zeros(0)
+        order = np.lexsort((energy, d))
+        acceptor, d, energy = acceptor[order], d[order], energy[order]
+        rank = np.arange(len(d)) - np.searchsorted(d, d, side='left')
+        keep = rank < 2
+        return acceptor[keep], d[keep], energy[keep]
+
+    @staticmethod
+    def calculate_dssp(df_atom: pd.DataFrame, cutoff: float=9.0, max_peptide_bond: float=2.5):
+        # secondary structure of every residue of every chain from the backbone coordinates alone, following
+        # DSSP (Kabsch & Sander 1983): n-turns are hydrogen bonds C=O(i)..H-N(i+n), two consecutive 4/3/5-turns
+        # give an alpha (H), 3-10 (G) or pi (I) helix, two bonds between residues of different strands a
+        # parallel or antiparallel bridge, and bridges linked into ladders (allowing bulges of up to 1 and 4
+        # residues) a strand (E) while lone bridges are B. T marks turns outside helices and S bends (CA angle
+        # over 70 degrees), priority H > B > E > G > I > T > S. a chain breaks where C(i-1)-N(i) is longer than
+        # max_peptide_bond. dssp_ss folds the labels into the 'H'/'E'/'-' of label_secondary_structure.
+        # returns (residues, hydrogen bonds), the residue rows line up with build_backbone_angles
+        df_residue, chain, coords = pdb_utilities.backbone_coordinates(df_atom, ('N', 'CA', 'C', 'O'))
+        n_res = len(df_residue)
+        n, ca, c = coords['N'], coords['CA'], coords['C']
+        with np.errstate(invalid='ignore'):
+            bonded = (chain[:-1] == chain[1:]) & (np.linalg.norm(n[1:] - c[:-1], axis=1) < max_peptide_bond)
+        # residues a and b are in one unbroken stretch of chain if their segments are the same
+        segment = np.cumsum(np.r_[True, ~bonded])
+        donor = df_residue['res_name'].astype(str).to_numpy() != 'PRO'
+        acceptor, donor, energy = pdb_utilities.calculate_hbond_energies(chain, coords, bonded, donor, cutoff)
+        keys = np.sort(acceptor * n_res + donor)
+
+        def hbond(a: np.ndarray, b: np.ndarray):
+            # whether the C=O of residue a bonds to the N-H of residue b
+            valid = (a >= 0) & (a < n_res) & (b >= 0) & (b < n_res)
+            if not len(keys):
+                return np.zeros(len(a), dtype=bool)
+            key = np.where(valid, a * n_res + b, -1)
+            pos = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            return valid & (keys[pos] == key)
+
+        def unbroken(a: np.ndarray, b: np.ndarray):
+            valid = (a >= 0) & (a < n_res) & (b >= 0) & (b < n_res)
+            return valid & (segment[np.clip(a, 0, n_res - 1)] == segment[np.clip(b, 0, n_res - 1)])
+
+        i = np.arange(n_res)
+        dssp = np.full(n_res, '-', dtype='U1')
+
+        # bends
+        with np.errstate(invalid='ignore'):
+            u = ca[i] - ca[np.maximum(i - 2, 0)]
+            v = ca[np.minimum(i + 2, n_res - 1)] - ca[i]
+            cos = np.sum(u * v, axis=1) / (np.linalg.norm(u, axis=1) * np.linalg.norm(v, axis=1))
+            dssp[unbroken(i - 2, i + 2) & (cos < np.cos(np.radians(70)))] = 'S'
+
+        turn = {k: hbond(i, i + k) & unbroken(i, i + k) for k in [3, 4, 5]}
+        for k in [3, 4, 5]:
+            start = np.flatnonzero(turn[k])
+            for offset in range(1, k):
+                dssp[start + offset] = 'T'
+
+        def helix(k: int, label: str):
+            # residues i..i+k-1 of two consecutive k-turns at i-1 and i
+            start = np.flatnonzero(turn[k][1:] & turn[k][:-1]) + 1
+            for offset in range(k):
+                dssp[start + offset] = label
+
+        helix(5, 'I')
+        helix(3, 'G')
+
+        # bridges between residues p < q at least 3 apart, candidates are the pairs next to a hydrogen bond
+        p = np.concatenate([acceptor + 1, acceptor, acceptor + 1])
+        q = np.concatenate([donor, donor, donor - 1])
+        p, q = np.minimum(p, q), np.maximum(p, q)
+        keep = (q - p >= 3) & (p >= 1) & (q < n_res - 1)
+        pairs = np.unique(p[keep] * n_res + q[keep])
+        p, q = pairs // n_res, pairs % n_res
+        keep = unbroken(p - 1, p + 1) & unbroken(q - 1, q + 1) & (chain[p] == chain[q])
+        p, q = p[keep], q[keep]
+        antiparallel = (hbond(p, q) & hbond(q, p)) | (hbond(p - 1, q + 1) & hbond(q - 1, p + 1))
+        parallel = ~antiparallel & ((hbond(p - 1, q) & hbond(q, p + 1)) | (hbond(q - 1, p) & hbond(p, q + 1)))
+        keep = antiparallel | parallel
+        p, q, antiparallel = p[keep], q[keep], antiparallel[keep]
+
+        # bridges of the same kind follow each other in a ladder, with a bulge of at most 1 residue on one
+        # strand and 4 on the other. q runs backwards along antiparallel ladders
+        # p, q come sorted by p * n_res + q, so bridge_keys is sorted and lines up with them
+        bridge_keys = (p * n_res + q) * 2 + antiparallel
+        linked = np.zeros(len(p), dtype=bool)
+        l_start, l_end = list(), list()
+        for dp in range(1, 6):
+            for dq in range(1, 6):
+                if min(dp, dq) > 2:
+                    continue
+                p2 = p + dp
+                q2 = np.where(antiparallel, q - dq, q + dq)
+                valid = (p2 < q2) & unbroken(p, p2) & unbroken(q, q2)
+                key = np.where(valid, (p2 * n_res + q2) * 2 + antiparallel, -1)
+                if not len(bridge_keys):
+                    continue
+                pos = np.minimum(np.searchsorted(bridge_keys, key), len(bridge_keys) - 1)
+                found = valid & (bridge_keys[pos] == key)
+                linked[found] = True
+                linked[np.searchsorted(bridge_keys, key[found])] = True
+                l_start += [p[found], np.minimum(q, q2)[found]]
+                l_end += [p2[found], np.maximum(q, q2)[found]]
+        if l_start:
+            positions, _ = pdb_utilities.expand_intervals(np.concatenate(l_start), np.concatenate(l_end))
+            dssp[positions] = 'E'
+        dssp[p[~linked]] = 'B'
+        dssp[q[~linked]] = 'B'
+
+        helix(4, 'H')
+
+        df_residue['dssp'] = dssp
+        df_residue['dssp_ss'] = pd.Series(dssp).map({'H': 'H', 'G': 'H', 'I': 'H', 'E': 'E', 'B': 'E'}).fillna('-').to_numpy()
+        df_hbonds = pd.DataFrame({'protein_name': df_residue['protein_name'].to_numpy()[acceptor],
+                                  'acceptor': acceptor, 'donor': donor,
+                                  'acceptor_res_seq': df_residue['res_seq'].to_numpy()[acceptor],
+                                  'donor_res_seq': df_residue['res_seq'].to_numpy()[donor],
+                                  'energy': energy})
+        return df_residue, df_hbonds
+
+    def build_dssp(self, cutoff: float=9.0, max_peptide_bond: float=2.5):
+        # dssp labels of every residue in df_atom (see calculate_dssp), for chains whose HELIX/SHEET records
+        # are missing or inconsistent. the hydrogen bonds are kept in df_hbonds
+        with metrics.timer('dssp'):
+            self.df_dssp, self.df_hbonds = self.calculate_dssp(self.df_atom, cutoff, max_peptide_bond)
+        metrics.add('hbonds', len(self.df_hbonds))
+        return self.df_dssp
+
+    def compare_secondary_structure(self):
+        # the HELIX/SHEET labels (ss) and the dssp labels of every residue side by side, e.g.
+        # pd.crosstab(df['ss'], df['dssp']). has_records is False for chains without any HELIX or SHEET record,
+        # where dssp is the only assignment there is
+        df_ss = self.get_secondary_structure()
+        df_dssp = self.build_dssp() if self.df_dssp is None else self.df_dssp
+        df = df_ss[['protein_name', 'res_seq', 'iCode', 'res_name', 'ss', 'helix_class', 'sheet_id']].copy()
+        df['dssp'] = df_dssp['dssp'].to_numpy()
+        df['dssp_ss'] = df_dssp['dssp_ss'].to_numpy()
+        recorded = set(self.df_helix['protein_name'].astype(str)) | set(self.df_sheet['protein_name'].astype(str))
+        df['has_records'] = df['protein_name'].astype(str).isin(recorded).to_numpy()
+        return df
+
+    def build_segments(self, kind: str='helix', length: int=7, atoms: tuple=('CA',), step: int=1,
+                       max_ca_ca: float=4.2):
+        # windows of length consecutive residues inside every HELIX (kind='helix') or SHEET (kind='strand')
+        # record, starting every step residues, for pdb_superpose. the atoms of each residue are stacked to
+        # coordinates of shape (n_segments, length * len(atoms), 3). windows with a missing atom or a chain
+        # break (CA-CA longer than max_ca_ca) are left out. returns (segments, coordinates), segments has the
+        # chain and first residue of every window, its position in the residue table and its record
+        if kind not in ['helix', 'strand']:
+            raise ValueError('kind has to be helix or strand, not {}'.format(kind))
+        df_residue, chain, coords = self.backbone_coordinates(self.df_atom, tuple(dict.fromkeys(tuple(atoms) + ('CA',))))
+        xyz = np.stack([coords[name] for name in atoms], axis=1)
+
+        # bad[i] is set if residue i lacks an atom or is not linked to residue i+1, windows must have none
+        # except at their last residue
+        complete = np.isfinite(xyz).all(axis=(1, 2))
+        with np.errstate(invalid='ignore'):
+            linked = np.r_[(chain[:-1] == chain[1:]) &
+                           (np.linalg.norm(coords['CA'][1:] - coords['CA'][:-1], axis=1) < max_ca_ca), False]
+        n_incomplete = np.r_[0, np.cumsum(~complete)]
+        n_unlinked = np.r_[0, np.cumsum(~linked)]
+
+        df_records = self.df_helix if kind == 'helix' else self.df_sheet
+        start, end, df_records = self.record_bounds(df_residue, df_records)
+        long_enough = end - start + 1 >= length
+        start, end, df_records = start[long_enough], end[long_enough], df_records[long_enough]
+        first, record = self.expand_intervals(start, end - length + 1)
+        keep = ((first - start[record]) % step == 0) & \
+               (n_incomplete[first + length] == n_incomplete[first]) & \
+               (n_unlinked[first + length - 1] == n_unlinked[first])
+        first, record = first[keep], record[keep]
+
+        df_segments = df_residue.iloc[first][['protein_name', 'res_seq', 'iCode', 'res_name']].reset_index(drop=True)
+        df_segments['position'] = first
+        record_columns = ['helix_id', 'helix_class'] if kind == 'helix' else ['sheet_id', 'strand', 'sense']
+        for label in record_columns:
+            df_segments[label] = df_records[label].to_numpy()[record]
+        segments = xyz[first[:, None] + np.arange(length)].reshape(len(first), length * len(atoms), 3)
+        return df_segments, segments
+
+    def build_ramachandran_ss(self):
+        # angle table with the secondary structure labels of every residue (rows line up one to one)
+        df_ss = self.get_secondary_structure()
+        df_angles = self.get_backbone_angles()
+        return pd.concat([df_ss, df_angles[['phi', 'psi', 'omega']]], axis=1)
+
+    def build_ramachandran_helices(self):
+        df = self.build_ramachandran_ss()
+        df = df[df['ss'] == 'H']
+        df_helices_ramanchandran = pd.DataFrame({'helix_type': df['helix_type'],
+                                                 'helix_class': df['helix_class'],
+                                                 'protein_name': df['protein_name'].astype(str),
+                                                 'aa_seq_num': df['res_seq'],
+                                                 'psi': df['psi'],
+                                                 'phi': df['phi']})
+        return df_helices_ramanchandran.reset_index(drop=True)
 
+    def build_ramachandran_strands(self):
+        df = self.build_ramachandran_ss()
+        df = df.loc[df['ss'] == 'E', ['protein_name', 'sheet_id', 'strand', 'sense', 'res_name', 'res_seq', 'iCode',
+                                      'psi', 'phi']]
+        return df.reset_index(drop=True)
 
 if __name__ == '__main__':
     pdb_parser = pdb_parser(100)